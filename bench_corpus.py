@@ -0,0 +1,154 @@
+# bench_corpus.py
+"""
+Benchmark and regression run of the full sanitize_signal pipeline over a golden corpus.
+
+Every message in corpus/sanitizer_golden.jsonl carries the trade ideas it contains.
+The messages are sanitized `rounds` times with up to `concurrency` in flight, against
+the local stand-in server from llm_stub.py, and the runner reports throughput, p50/p99
+latency per message and extraction accuracy (messages whose atomic signals match
+exactly, and signal-level precision/recall; expected signals are the corpus ideas run
+through ideas_to_signals).
+
+By default the stub answers every LLM prompt with the corpus ideas (a perfect model), so
+accuracy measures the pipeline itself: fast path, splitting, compaction and parsing.
+--record FILE asks the real provider (AI_KEY/AI_BASE_URL from .env) for every prompt the
+pipeline sends and stores the answers; --replay FILE serves those recorded answers, which
+measures the real model's extraction offline.
+
+Usage: python bench_corpus.py [--rounds N] [--concurrency C] [--latency S] [--sigma X]
+                              [--error-rate R] [--fast-path on|off|shadow]
+                              [--replay FILE | --record FILE] [--corpus FILE]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import time
+from collections import Counter
+
+parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+parser.add_argument("--corpus", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                     "corpus", "sanitizer_golden.jsonl"))
+parser.add_argument("--rounds", type=int, default=20)
+parser.add_argument("--concurrency", type=int, default=16)
+parser.add_argument("--latency", type=float, default=0.3, help="median stub latency (s)")
+parser.add_argument("--sigma", type=float, default=0.5, help="lognormal sigma of the stub latency")
+parser.add_argument("--error-rate", type=float, default=0.02)
+parser.add_argument("--fast-path", choices=("on", "off", "shadow"), default="on",
+                    help="SANITIZER_FAST_PATH for the run ('off' sends every message to the LLM)")
+parser.add_argument("--replay", help="serve recorded answers from this JSONL file")
+parser.add_argument("--record", help="record real provider answers into this JSONL file")
+args = parser.parse_args()
+
+stub = None
+if not args.record:
+    from llm_stub import StubLLMServer
+
+    stub = StubLLMServer(latency=args.latency, latency_sigma=args.sigma, error_rate=args.error_rate, seed=1).start()
+    os.environ["AI_BASE_URL"] = stub.base_url
+    os.environ["AI_KEY"] = "stub-key"
+    os.environ["AI_PROVIDERS"] = ""
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ["SANITIZER_FAST_PATH"] = args.fast_path
+
+import sanitizer  # noqa: E402  (must see the environment above)
+
+sanitizer.logger.setLevel(logging.ERROR)
+logging.getLogger("signalworker.llm_providers").setLevel(logging.ERROR)  # injected errors are expected
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def fingerprint(signals):
+    def num(value):
+        return round(float(value), 5) if isinstance(value, (int, float)) else value
+    return Counter((s.get("instrument"), s.get("signal"), num(s.get("entry")), num(s.get("sl")), num(s.get("tp")))
+                   for s in signals)
+
+
+def llm_prompts(entry):
+    """
+    (text the LLM sees, ideas it should return) for the whole message and, if the
+    pipeline splits it into one block per idea, for each block.
+    """
+    prompts = [(sanitizer._llm_text(entry["text"]), entry["ideas"])]
+    blocks = sanitizer.split_signal_blocks(entry["text"])
+    if len(blocks) > 1 and len(blocks) == len(entry["ideas"]):
+        prompts += [(sanitizer._llm_text(block), [idea]) for block, idea in zip(blocks, entry["ideas"])]
+    return prompts
+
+
+async def record(corpus, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in corpus:
+            for llm_text, _ in llm_prompts(entry):
+                content = await sanitizer.sanitize_with_ai(llm_text, timeout=30)
+                f.write(json.dumps({"match": llm_text, "content": content}, ensure_ascii=False) + "\n")
+                print(f"{entry['id']}: {len(content)} chars recorded")
+
+
+async def run(corpus, rounds, concurrency):
+    if args.replay:
+        print(f"Replaying {stub.load_recordings(args.replay)} recorded answers")
+    else:
+        for entry in corpus:
+            for llm_text, ideas in llm_prompts(entry):
+                stub.add_response(llm_text, json.dumps(ideas, indent=2))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index, entry):
+        async with semaphore:
+            start = time.perf_counter()
+            result = await sanitizer.sanitize_signal(entry["text"], source=entry["channel"],
+                                                     link=f"https://t.me/c/0/{index}")
+            return time.perf_counter() - start, result["signals"]
+
+    jobs = [entry for _ in range(rounds) for entry in corpus]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # sanitize_signal prints a debug line per call
+        results = await asyncio.gather(*(one(i, entry) for i, entry in enumerate(jobs)))
+    wall = time.perf_counter() - start
+
+    exact, expected_total, found_total, matched_total = 0, 0, 0, 0
+    mismatches = {}
+    for entry, (_, signals) in zip(jobs, results):
+        expected = fingerprint(sanitizer.ideas_to_signals(entry["ideas"], source="expected"))
+        found = fingerprint(signals)
+        exact += found == expected
+        expected_total += sum(expected.values())
+        found_total += sum(found.values())
+        matched_total += sum((found & expected).values())
+        if found != expected:
+            mismatches.setdefault(entry["id"], (sorted(expected.elements()), sorted(found.elements())))
+
+    latencies = sorted(r[0] * 1e3 for r in results)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{len(jobs)} messages ({len(corpus)} x {rounds}), concurrency {concurrency}, "
+          f"stub median {args.latency}s sigma {args.sigma} error rate {args.error_rate}")
+    print(f"throughput {len(jobs) / wall:8.1f} msgs/s   p50 {statistics.median(latencies):7.1f} ms   "
+          f"p99 {p99:7.1f} ms   wall {wall:.2f} s")
+    print(f"accuracy   exact {exact / len(jobs):.1%}   precision {matched_total / found_total if found_total else 1:.1%}   "
+          f"recall {matched_total / expected_total if expected_total else 1:.1%}")
+    paths = Counter()
+    for channel in sanitizer.fast_path_stats.report().values():
+        paths.update(fast_path=channel["fast_path"], llm=channel["llm"])
+    print(f"paths      fast path {paths['fast_path'] if args.fast_path != 'off' else 'off'}   "
+          f"stub requests {stub.requests} (hedges {sanitizer.provider_pool.hedges}, injected errors {stub.errors})")
+    for message_id, (expected, found) in mismatches.items():
+        print(f"MISMATCH {message_id}:\n  expected {expected}\n  found    {found}")
+
+
+if __name__ == "__main__":
+    corpus = load_corpus(args.corpus)
+    if args.record:
+        asyncio.run(record(corpus, args.record))
+    else:
+        asyncio.run(run(corpus, args.rounds, args.concurrency))
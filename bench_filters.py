@@ -0,0 +1,126 @@
+# bench_filters.py
+"""
+Throughput benchmark for filters.should_ignore_message on a synthetic post corpus.
+
+The posts come from corpus/channel_posts.jsonl and corpus/sanitizer_golden.jsonl
+(signals, results, updates, chatter and promo). They are hand-written in the style of
+the channels, except the two samples taken from this repo (see corpus/README.md), so
+the rates and reason counts say nothing about real channel traffic. Compared:
+
+  * "legacy":   the previous implementation, which builds one regex per blacklist keyword
+                per message and scans the keyword lists with `in`
+  * "compiled": the current one, one precompiled alternation per rule class
+
+Every post must get the same decision from both (the run aborts otherwise). Reports
+messages/second and the reasons classify_message gives, then classifies a ~100k post
+export with filters.filter_batch in-process and in a process pool.
+
+Usage: python bench_filters.py [rounds]
+"""
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+os.environ["MESSAGE_FILTER_RULES"] = ""  # eingebaute Regeln, wie die Legacy-Implementierung
+
+import filters  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+
+def log_skipped_signal(reason, text):
+    pass  # der frühere Platzhalter in filters.py
+
+
+def legacy_should_ignore_message(text: str) -> bool:
+    original_text = text
+    text_lower = text.lower().strip()
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    is_pips_manipulation = re.search(r"\+\d+\s*pips", text_lower)
+
+    found_required_kw = any(kw.lower() in text_lower for kw in filters.REQUIRED_TRADING_KEYWORDS)
+    if not found_required_kw and not is_pips_manipulation:
+        log_skipped_signal(f"{timestamp} - Ignoring: No core trading keyword found", original_text)
+        return True
+
+    for word in filters.BLACKLIST_KEYWORDS:
+        pattern = r'(?:^|\b)' + re.escape(word) + r'[\s\W]*'
+        if re.search(pattern, original_text, re.IGNORECASE):
+            log_skipped_signal(f"🛑 Ignoring: matched blacklist keyword '{word}'", original_text)
+            return True
+
+    has_sl = bool(re.search(r'\bsl\b[\s:\-]*\d+', text_lower) or re.search(r'stop\s*loss', text_lower)
+                  or re.search(r'🟣', text))
+    has_tp = bool(re.search(r'tp\d*[\s:=+\-]*[\$\d\.]+', text_lower) or re.search(r'🟡', text)
+                  or re.search(r'\btp\d*[\s:=+\-]*\d+\s*p[ip]*s?\b', text_lower)
+                  or re.search(r'take\s*profit', text_lower))
+    manipulation_cmds = ["close all", "close at entry", "move sl to", "cancel pending", "cancel", "close", "set be", "break even"]
+    has_manipulation_cmd = any(cmd in text_lower for cmd in manipulation_cmds)
+    if not (has_sl or has_tp or has_manipulation_cmd or is_pips_manipulation):
+        log_skipped_signal(f"{timestamp} - Ignoring: missing SL or TP or manipulation commands", original_text)
+        return True
+
+    for pattern in filters.UPDATE_PATTERNS:
+        if re.search(pattern, text_lower) and not is_pips_manipulation:
+            log_skipped_signal("Ignored signal: update pattern detected", original_text)
+            return True
+    return False
+
+
+def load_posts() -> list[str]:
+    posts = []
+    for name in ("channel_posts.jsonl", "sanitizer_golden.jsonl"):
+        with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+            posts += [json.loads(line)["text"] for line in f if line.strip()]
+    posts.append(filters.message)
+    # Varianten: Groß-/Kleinschreibung und zusammengesetzte Posts
+    posts += [p.upper() for p in posts] + [a + "\n\n" + b for a, b in zip(posts, reversed(posts))]
+    return posts
+
+
+def measure(label, func, posts, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in posts:
+            func(text)
+    elapsed = time.perf_counter() - start
+    rate = rounds * len(posts) / elapsed
+    print(f"{label:<9} {rate:10.0f} msgs/s   {elapsed * 1e6 / (rounds * len(posts)):6.1f} µs/msg")
+    return rate
+
+
+def main(rounds):
+    posts = load_posts()
+    differing = [p for p in posts if legacy_should_ignore_message(p) != filters.should_ignore_message(p)]
+    if differing:
+        for text in differing:
+            print(f"DIFFERENT DECISION: {text[:80]!r}")
+        sys.exit(1)
+    print(f"{len(posts)} posts, identical decisions, {rounds} rounds")
+
+    before = measure("legacy", legacy_should_ignore_message, posts, rounds)
+    after = measure("compiled", filters.should_ignore_message, posts, rounds)
+    print(f"speedup   {after / before:10.1f}x")
+    reasons = Counter(filters.classify_message(p) or "keep" for p in posts)
+    print("reasons   " + ", ".join(f"{reason} {count}" for reason, count in reasons.most_common()))
+
+    # filter_batch über einen großen Export, im Prozess und im Prozesspool
+    export = posts * max(1, 100_000 // len(posts))
+    expected = [filters.classify_message(p) for p in posts]
+    workers = max(2, os.cpu_count() or 1)
+    for label, processes in (("batch", 1), (f"pool x{workers}", workers)):
+        start = time.perf_counter()
+        codes = filters.filter_batch(export, processes=processes)
+        elapsed = time.perf_counter() - start
+        if [filters.REASON_CODES[c] for c in codes[:len(posts)]] != expected or len(codes) != len(export):
+            print(f"{label}: DIFFERENT RESULT")
+            sys.exit(1)
+        print(f"{label:<9} {len(export) / elapsed:10.0f} msgs/s   {len(export)} posts, {len(codes)} byte result")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,83 @@
+# bench_llm_scheduler.py
+"""
+Benchmark for live signals arriving while a historical backfill shares the LLM quota.
+
+A local stub (llm_stub.py) enforces an RPM limit and answers 429 beyond it. A backfill
+of B requests is started, and L live requests arrive one every interval. Compared:
+
+  * "unscheduled": no RPM budget and the same priority for everything (the previous
+    behaviour, apart from 429 retries now waiting for the provider's retry-after)
+  * "scheduled":   RateLimitScheduler with the RPM budget, backfill at PRIORITY_BACKFILL
+
+Reports live latency (p50/max), backfill duration and how many 429s the stub sent.
+
+Usage: python bench_llm_scheduler.py [backfill] [live] [rpm]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("AI_RATE_LIMIT_RETRIES", "5")
+
+from llm_providers import Provider, ProviderPool  # noqa: E402
+from llm_scheduler import PRIORITY_BACKFILL, PRIORITY_LIVE, llm_priority  # noqa: E402
+from llm_stub import StubLLMServer  # noqa: E402
+
+PROMPT = "Extract the signal.\nXAUUSD BUY LIMIT\nEntry: 1930 - 1932\nSL: 1920\nTP: 30 pips"
+LIVE_INTERVAL = 0.5
+
+
+async def request(pool, priority, timeout=300):
+    llm_priority.set(priority)
+    start = time.perf_counter()
+    try:
+        await pool.complete(PROMPT, timeout=timeout, hedge=False)
+        ok = True
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+async def live_stream(pool, count):
+    results = []
+    for _ in range(count):
+        results.append(asyncio.create_task(request(pool, PRIORITY_LIVE)))
+        await asyncio.sleep(LIVE_INTERVAL)
+    return await asyncio.gather(*results)
+
+
+async def scenario(label, backfill, live, rpm, scheduled):
+    stub = StubLLMServer(latency=0.2, rpm=rpm).start()
+    provider = Provider("stub", stub.base_url, "stub-model", "stub-key", max_concurrency=8,
+                        rpm=rpm if scheduled else 0)
+    pool = ProviderPool([provider])
+    backfill_priority = PRIORITY_BACKFILL if scheduled else PRIORITY_LIVE
+
+    start = time.perf_counter()
+    backfill_task = asyncio.gather(*(request(pool, backfill_priority) for _ in range(backfill)))
+    await asyncio.sleep(0.1)  # backfill is already queued when live traffic starts
+    live_results = await live_stream(pool, live)
+    backfill_results = await backfill_task
+    backfill_wall = time.perf_counter() - start
+
+    live_latencies = sorted(r[0] * 1e3 for r in live_results)
+    print(f"{label:<12} live ok {sum(r[1] for r in live_results)}/{live}  "
+          f"p50 {statistics.median(live_latencies):7.0f} ms  max {live_latencies[-1]:7.0f} ms   "
+          f"backfill ok {sum(r[1] for r in backfill_results)}/{backfill} in {backfill_wall:5.1f} s   "
+          f"429s {stub.rate_limited}")
+    stub.shutdown()
+
+
+async def main(backfill, live, rpm):
+    print(f"stub limit {rpm} RPM, {backfill} backfill requests, {live} live requests every {LIVE_INTERVAL}s")
+    await scenario("unscheduled", backfill, live, rpm, scheduled=False)
+    await scenario("scheduled", backfill, live, rpm, scheduled=True)
+
+
+if __name__ == "__main__":
+    n_backfill = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+    n_live = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    limit = float(sys.argv[3]) if len(sys.argv) > 3 else 120
+    asyncio.run(main(n_backfill, n_live, limit))
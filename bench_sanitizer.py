@@ -0,0 +1,87 @@
+# bench_sanitizer.py
+"""
+Latency benchmark for sanitize_with_ai against the local LLM stub (llm_stub.py).
+
+Fires bursts of concurrent calls and compares
+
+  * "thread": the previous sync OpenAI client wrapped in asyncio.to_thread
+  * "async":  the pooled AsyncOpenAI client used by sanitizer.py
+
+It then runs a burst whose requests all exceed the timeout and measures the
+latency of the next call (abandoned threads vs. cancelled requests).
+
+Usage: python bench_sanitizer.py [concurrency] [latency_seconds]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from llm_stub import StubLLMServer
+
+stub = StubLLMServer(latency=0.2).start()
+os.environ["AI_BASE_URL"] = stub.base_url
+os.environ.setdefault("AI_KEY", "stub-key")
+
+import sanitizer  # noqa: E402  (must see AI_BASE_URL above)
+from openai import OpenAI  # noqa: E402
+
+TEXT = "XAUUSD BUY LIMIT\nEntry: 1930 - 1932\nSL: 1920\nTP: 30 pips – 50 pips – 80 pips - Open"
+
+legacy_client = OpenAI(api_key=sanitizer.AI_KEY, base_url=stub.base_url)
+
+
+async def legacy_sanitize_with_ai(signal_text, timeout=10):
+    prompt = sanitizer.ai_prompt.format(text=signal_text)
+    try:
+        def blocking_call():
+            return legacy_client.chat.completions.create(
+                model=sanitizer.AI_MODEL,
+                messages=[{"role": "system", "content": prompt}],
+                temperature=0.1,
+            )
+        response = await asyncio.wait_for(asyncio.to_thread(blocking_call), timeout=timeout)
+        return response.choices[0].message.content
+    except Exception:
+        return ""
+
+
+async def burst(fn, concurrency, timeout=10):
+    async def one():
+        start = time.perf_counter()
+        ok = bool(await fn(TEXT, timeout=timeout))
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    latencies = sorted(r[0] * 1e3 for r in results)
+    return latencies, sum(r[1] for r in results), wall
+
+
+async def main(concurrency, latency):
+    stub.latency = latency
+    for label, fn in (("thread", legacy_sanitize_with_ai), ("async", sanitizer.sanitize_with_ai)):
+        await burst(fn, 2)  # warm up connections
+        latencies, ok, wall = await burst(fn, concurrency)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{label:<7} {ok}/{concurrency} ok   p50 {statistics.median(latencies):7.0f} ms   "
+              f"p99 {p99:7.0f} ms   wall {wall:5.2f} s")
+
+    print(f"\nafter a timeout burst ({concurrency} calls, stub latency 1.0 s, timeout 0.2 s):")
+    for label, fn in (("thread", legacy_sanitize_with_ai), ("async", sanitizer.sanitize_with_ai)):
+        stub.latency = 1.0
+        await burst(fn, concurrency, timeout=0.2)
+        # Abandoned to_thread calls keep their executor threads until the HTTP call returns;
+        # cancelled async calls have already released their concurrency slot.
+        stub.latency = latency
+        latencies, ok, _ = await burst(fn, 1)
+        print(f"{label:<7} next call took {latencies[0]:7.0f} ms (ok={bool(ok)})")
+        await asyncio.sleep(1.0)
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    lat = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    print(f"AI_MAX_CONCURRENCY={sanitizer.AI_MAX_CONCURRENCY}, stub latency {lat}s, {n} concurrent calls")
+    asyncio.run(main(n, lat))
@@ -0,0 +1,136 @@
+# bench_signal_batch.py
+"""
+Benchmark for per-update batch maintenance in process_sanitized_signal.
+
+Starts from a 1k-entry signal batch and applies a stream of updates (new
+manipulation entries plus re-sent entries that replace existing ones), comparing
+
+  * "rebuild": the previous extend + dict dedup + full sort + json.dumps
+  * "batch":   SignalBatch.upsert + serialize() from cached fragments
+
+Both must produce byte-identical documents. Finally checks that BoundedSignalStore.stats()
+counts the entries held in a SignalBatch (approx_bytes at least that of the plain list),
+and how moving entries in the batch order scales from 1k to 100k entries.
+
+Usage: python bench_signal_batch.py [batch_size] [updates]
+"""
+import json
+import random
+import statistics
+import sys
+import time
+from bisect import bisect_left, insort
+
+from signal_batch import SignalBatch, SortedBuckets
+from signal_store import BoundedSignalStore
+
+
+def signal_key(sig):
+    # Same key as signal_processor.signal_key (not imported: it pulls in Flask and Dropbox)
+    return (
+        sig.get("telegram_message_id"),
+        sig.get("manipulation"),
+        sig.get("instrument"),
+        sig.get("entry"),
+        sig.get("signal")
+    )
+
+
+def make_entry(msg_id, i, minute, manipulation=None):
+    return {
+        "instrument": "XAUUSD", "signal": "BUY LIMIT", "entry": round(2400 - i * 0.1, 2), "sl": 2390,
+        "tp": 2410, "time": f"2025-01-01 {minute // 60:02d}:{minute % 60:02d}:00+00:00", "source": "bench",
+        "signalid": "bench-signal", "manipulation": manipulation, "telegram_message_id": msg_id,
+        "link": f"https://t.me/c/1/{msg_id}",
+    }
+
+
+def rebuild(current_batch, new_entries):
+    current_batch.extend(new_entries)
+    dedup = list({signal_key(s): s for s in current_batch}.values())
+    dedup.sort(key=lambda s: s.get("time") or "1970-01-01T00:00:00Z")
+    return dedup, json.dumps({"signals": dedup}, indent=2)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    updates = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    rng = random.Random(7)
+    initial = [make_entry(i // 4, i, i // 4) for i in range(size)]
+    stream = []
+    for u in range(updates):
+        if rng.random() < 0.7:
+            stream.append(make_entry(10_000 + u, 0, size // 4 + u, manipulation="SL_CHANGE"))
+        else:
+            # re-sent existing entry with the same key and time (replaces it in place)
+            stream.append(dict(rng.choice(initial), tp=2420 + u))
+
+    legacy = list(initial)
+    batch = SignalBatch(signal_key, initial)
+    legacy, _ = rebuild(legacy, [])
+    batch.serialize()
+
+    t_rebuild, t_batch = [], []
+    for entry in stream:
+        start = time.perf_counter()
+        legacy, doc_legacy = rebuild(legacy, [entry])
+        t_rebuild.append((time.perf_counter() - start) * 1e6)
+
+        start = time.perf_counter()
+        batch.upsert(entry)
+        doc_batch = batch.serialize()
+        t_batch.append((time.perf_counter() - start) * 1e6)
+
+        assert doc_batch == doc_legacy, "serialized batches differ"
+
+    print(f"{updates} updates on a {size}-entry batch (final size {len(batch)})")
+    for label, samples in (("rebuild", t_rebuild), ("batch", t_batch)):
+        print(f"{label:<8} mean {statistics.fmean(samples):9.1f} µs/update   p50 {statistics.median(samples):9.1f} µs")
+    print(f"speedup  {statistics.fmean(t_rebuild) / statistics.fmean(t_batch):.1f}x (outputs identical)")
+
+    # Memory stat of the store (/signal-store-stats) must see the entries inside a SignalBatch
+    as_batch, as_list = BoundedSignalStore("batch", 10), BoundedSignalStore("list", 10)
+    as_batch["bench-signal"] = batch
+    as_list["bench-signal"] = batch.to_list()
+    batch_bytes, list_bytes = as_batch.stats()["approx_bytes"], as_list.stats()["approx_bytes"]
+    print(f"memory   approx_bytes SignalBatch {batch_bytes}   same entries as list {list_bytes}")
+    assert batch_bytes >= list_bytes, "approx_bytes misses the entries of a SignalBatch"
+
+    order_scaling()
+
+
+def order_scaling(sizes=(1_000, 10_000, 100_000), moves=5_000):
+    """
+    Cost of moving an entry to a random new time (remove + insert) in the batch order:
+    a flat sorted list (the previous layout, O(n) memmove) vs. SortedBuckets (O(log n)).
+    """
+    rng = random.Random(11)
+    print("order    remove + insert at random positions, µs/op")
+    for size in sizes:
+        items = [(rng.random(), i) for i in range(size)]
+        live, ops = list(items), []
+        for k in range(moves):
+            index = rng.randrange(size)
+            new = (rng.random(), size + k)
+            ops.append((live[index], new))
+            live[index] = new
+
+        flat, buckets = sorted(items), SortedBuckets()
+        for item in items:
+            buckets.add(item)
+        start = time.perf_counter()
+        for old, new in ops:
+            del flat[bisect_left(flat, old)]
+            insort(flat, new)
+        t_flat = (time.perf_counter() - start) * 1e6 / moves
+        start = time.perf_counter()
+        for old, new in ops:
+            buckets.remove(old)
+            buckets.add(new)
+        t_buckets = (time.perf_counter() - start) * 1e6 / moves
+        assert list(buckets) == flat, "orders differ"
+        print(f"  n={size:<7} flat list {t_flat:7.2f}   SortedBuckets {t_buckets:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
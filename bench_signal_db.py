@@ -0,0 +1,195 @@
+# bench_signal_db.py
+"""
+Micro-benchmark for the per-message SQLite cost of signal_db.
+
+Replays the DB calls a new 4-entry grid signal makes on the hot path
+(handler: get + store, processor: get + 4x add_entry) against
+
+  * "before": the original connect/execute/commit/close per call
+  * "after":  the pooled WAL connection from signal_db, with the handler
+              resolving the ID once via get_or_create_signalid and entries
+              going through the write-behind journal (the final flush is
+              reported separately)
+
+It then measures event-loop lag while bursts of messages hit the DB
+concurrently, calling signal_db directly from coroutines vs. awaiting the
+signal_db_async facade. Run with SIGNAL_DB_SYNCHRONOUS=FULL and
+SIGNAL_DB_ENTRY_FLUSH_SIZE=1 to see the effect of a slow, fsync-bound disk.
+
+Usage: python bench_signal_db.py [messages]
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+ENTRIES_PER_MESSAGE = 4
+
+_tmpdir = tempfile.mkdtemp(prefix="signal_db_bench_")
+os.environ["SIGNAL_DB_PATH"] = os.path.join(_tmpdir, "after.db")
+
+import signal_db  # noqa: E402  (must see SIGNAL_DB_PATH above)
+import signal_db_async  # noqa: E402
+
+
+# --- original implementation (connection per call) ---
+
+def legacy_store_signalid(path, telegram_message_id, signalid=None):
+    signalid = signalid or str(uuid.uuid4())
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    cur.execute("INSERT OR IGNORE INTO signals (telegram_message_id, signalid) VALUES (?, ?)",
+                (telegram_message_id, signalid))
+    conn.commit()
+    conn.close()
+    return signalid
+
+
+def legacy_get_signalid(path, telegram_message_id):
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    cur.execute("SELECT signalid FROM signals WHERE telegram_message_id = ?", (telegram_message_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def legacy_add_entry(path, signalid, telegram_message_id, entry_type, payload):
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO entries (signalid, telegram_message_id, type, payload)
+        VALUES (?, ?, ?, ?)
+    """, (signalid, telegram_message_id, entry_type, payload))
+    conn.commit()
+    conn.close()
+
+
+def legacy_init(path):
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE IF NOT EXISTS signals (
+        telegram_message_id INTEGER PRIMARY KEY, signalid TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, signalid TEXT NOT NULL, telegram_message_id INTEGER,
+        type TEXT, payload TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+    conn.commit()
+    conn.close()
+
+
+# --- workload ---
+
+def _payload(msg_id, i):
+    return json.dumps({"instrument": "XAUUSD", "signal": "BUY LIMIT", "entry": 2400 - i,
+                       "sl": 2390, "tp": 2410, "telegram_message_id": msg_id})
+
+
+def message_before(path, msg_id):
+    signalid = legacy_get_signalid(path, msg_id) or legacy_store_signalid(path, msg_id)
+    signalid = legacy_get_signalid(path, msg_id) or legacy_store_signalid(path, msg_id)
+    for i in range(ENTRIES_PER_MESSAGE):
+        legacy_add_entry(path, signalid, msg_id, "entry", _payload(msg_id, i))
+
+
+def message_after(msg_id):
+    signalid = signal_db.get_or_create_signalid(msg_id)
+    for i in range(ENTRIES_PER_MESSAGE):
+        signal_db.add_entry(signalid, msg_id, "entry", _payload(msg_id, i))
+
+
+def run(label, fn, messages):
+    samples = []
+    for msg_id in range(1, messages + 1):
+        start = time.perf_counter()
+        fn(msg_id)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{label:<8} mean {statistics.fmean(samples):9.1f} µs/msg   "
+          f"p50 {statistics.median(samples):9.1f} µs   p99 {p99:9.1f} µs")
+    return statistics.fmean(samples)
+
+
+# --- event-loop lag ---
+
+LAG_PROBE_INTERVAL = 0.001
+
+
+async def _lag_probe(samples, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(LAG_PROBE_INTERVAL)
+        samples.append((loop.time() - start - LAG_PROBE_INTERVAL) * 1e3)
+
+
+async def _message_sync(msg_id):
+    signalid = signal_db.get_or_create_signalid(msg_id)
+    for i in range(ENTRIES_PER_MESSAGE):
+        signal_db.add_entry(signalid, msg_id, "entry", _payload(msg_id, i))
+    await asyncio.sleep(0)
+
+
+async def _message_async(msg_id):
+    signalid = await signal_db_async.get_or_create_signalid(msg_id)
+    for i in range(ENTRIES_PER_MESSAGE):
+        await signal_db_async.add_entry(signalid, msg_id, "entry", _payload(msg_id, i))
+
+
+async def measure_lag(label, message_fn, first_id, bursts, burst_size):
+    samples = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_lag_probe(samples, stop))
+    start = time.perf_counter()
+    msg_id = first_id
+    for _ in range(bursts):
+        await asyncio.gather(*(message_fn(msg_id + i) for i in range(burst_size)))
+        msg_id += burst_size
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    samples.sort()
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{label:<8} loop lag p50 {statistics.median(samples):7.2f} ms   p99 {p99:7.2f} ms   "
+          f"max {samples[-1]:7.2f} ms   ({bursts}x{burst_size} msgs in {elapsed:.2f} s)")
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    before_path = os.path.join(_tmpdir, "before.db")
+    legacy_init(before_path)
+    signal_db.init_db()
+
+    print(f"{messages} messages, {ENTRIES_PER_MESSAGE} entries each, DB dir {_tmpdir}")
+    before = run("before", lambda m: message_before(before_path, m), messages)
+    after = run("after", message_after, messages)
+    start = time.perf_counter()
+    flushed = signal_db.flush()
+    print(f"final flush of {flushed} queued entries: {(time.perf_counter() - start) * 1e3:.1f} ms")
+    print(f"speedup  {before / after:.1f}x")
+
+    # Reply fan-out: several replies per recent signal, as in busy channels
+    recent = range(max(1, messages - 20), messages + 1)
+    start = time.perf_counter()
+    lookups = 0
+    for _ in range(10):
+        for msg_id in recent:
+            signal_db.get_signalid(msg_id)
+            lookups += 1
+    print(f"reply lookups {(time.perf_counter() - start) * 1e6 / lookups:.2f} µs each, cache {signal_db.cache_stats()}")
+
+    bursts, burst_size = 20, 25
+    print(f"\nevent-loop lag, {bursts} bursts of {burst_size} concurrent messages")
+    asyncio.run(measure_lag("sync", _message_sync, 100_000, bursts, burst_size))
+    asyncio.run(measure_lag("async", _message_async, 200_000, bursts, burst_size))
+    signal_db.close_db()
+
+
+if __name__ == "__main__":
+    main()
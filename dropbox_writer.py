@@ -1,27 +1,138 @@
 # dropbox_writer.py
+import bisect
+import threading
+import time
 import traceback
 
 import dropbox
 import os
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
+from dropbox.dropbox_client import BadInputException, TOKEN_EXPIRATION_BUFFER
+from signal_batch import SignalBatch
 logger = logging.getLogger("signalworker.filewriter")
 # Environment variables
 DROPBOX_REFRESH_TOKEN = os.getenv("DROPBOX_REFRESH_TOKEN")
 DROPBOX_APP_KEY = os.getenv("DROPBOX_APP_KEY")
 DROPBOX_APP_SECRET = os.getenv("DROPBOX_APP_SECRET")
 LOCAL_SIGNAL_FOLDER =  "local_signals"
+# Parallele Uploads (asyncio.to_thread) teilen sich so viele HTTP-Verbindungen
+DROPBOX_MAX_CONNECTIONS = int(os.getenv("DROPBOX_MAX_CONNECTIONS", "8"))
+# Token wird so lange vor Ablauf erneuert; größer als der Puffer des SDK, damit dessen eigene
+# (nicht synchronisierte) Erneuerung in request() nie parallel aus mehreren Threads läuft.
+DROPBOX_TOKEN_REFRESH_MARGIN = TOKEN_EXPIRATION_BUFFER + 60
+
+
+class DropboxClientHolder:
+    """
+    Process-wide Dropbox client: one HTTP session (connection pool, TLS reuse) for all
+    uploads, and an access token that is refreshed once near expiry instead of per upload.
+    Safe to share across threads; the refresh is serialized by a lock.
+    """
+
+    def __init__(self, refresh_token, app_key, app_secret, max_connections=DROPBOX_MAX_CONNECTIONS):
+        self._refresh_token = refresh_token
+        self._app_key = app_key
+        self._app_secret = app_secret
+        self._max_connections = max_connections
+        self._client = None
+        self._lock = threading.Lock()
+        self.refreshes = 0
+
+    def _needs_refresh(self) -> bool:
+        expiration = self._client._oauth2_access_token_expiration
+        return (not self._client._oauth2_access_token or not expiration
+                or datetime.utcnow() + timedelta(seconds=DROPBOX_TOKEN_REFRESH_MARGIN) >= expiration)
+
+    def get(self) -> dropbox.Dropbox:
+        client = self._client
+        if client is not None and not self._needs_refresh():
+            return client
+        with self._lock:
+            if self._client is None:
+                self._client = dropbox.Dropbox(
+                    oauth2_refresh_token=self._refresh_token,
+                    app_key=self._app_key,
+                    app_secret=self._app_secret,
+                    session=dropbox.create_session(max_connections=self._max_connections),
+                )
+            if self._needs_refresh():  # erneut prüfen: ein anderer Thread kann schon erneuert haben
+                self._client.refresh_access_token()
+                self.refreshes += 1
+                logger.info(f"🔑 Dropbox access token refreshed (valid until "
+                            f"{self._client._oauth2_access_token_expiration:%H:%M:%S} UTC)")
+            return self._client
+
+    def invalidate_token(self):
+        """
+        Forces a refresh on the next get() (e.g. after an AuthError for a revoked token).
+        """
+        with self._lock:
+            if self._client is not None:
+                self._client._oauth2_access_token = None
+
+
+class LatencyHistogram:
+    """
+    Upload latencies in fixed buckets (upper bounds in ms), thread-safe.
+    """
+
+    BOUNDS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.buckets = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.failures = 0
+        self.total_s = 0.0
+
+    def observe(self, seconds: float, ok: bool = True):
+        with self._lock:
+            self.buckets[bisect.bisect_left(self.BOUNDS_MS, seconds * 1e3)] += 1
+            self.count += 1
+            self.total_s += seconds
+            self.failures += not ok
+
+    def _quantile_ms(self, q: float):
+        # Obergrenze des Buckets, in dem das Quantil liegt
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.BOUNDS_MS + (float("inf"),), self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def report(self) -> dict:
+        with self._lock:
+            labels = [f"<={b}ms" for b in self.BOUNDS_MS] + [f">{self.BOUNDS_MS[-1]}ms"]
+            return {
+                "count": self.count,
+                "failures": self.failures,
+                "avg_ms": round(self.total_s / self.count * 1e3, 1) if self.count else None,
+                "p50_ms": self._quantile_ms(0.5) if self.count else None,
+                "p95_ms": self._quantile_ms(0.95) if self.count else None,
+                "buckets": dict(zip(labels, self.buckets)),
+            }
+
+
+dropbox_client = DropboxClientHolder(DROPBOX_REFRESH_TOKEN, DROPBOX_APP_KEY, DROPBOX_APP_SECRET)
+upload_latency = LatencyHistogram()
 
 
 def store_signal_batch(signals, signalid, USE_LOCAL_STORAGE, LOCAL_SIGNAL_FOLDER=None):
     """
     Store a signal batch locally or on Dropbox under 'signal_<signalid>.json',
-    governed by USE_LOCAL_STORAGE.
+    governed by USE_LOCAL_STORAGE. `signals` is a list or a SignalBatch
+    (which reuses its cached per-entry JSON).
     """
     import json, os
 
     filename = f"signal_{signalid}.json"
+    if isinstance(signals, SignalBatch):
+        document = signals.serialize()
+    else:
+        document = json.dumps({"signals": signals}, indent=2)
     if USE_LOCAL_STORAGE:
         if not LOCAL_SIGNAL_FOLDER:
             raise ValueError("LOCAL_SIGNAL_FOLDER must be set if USE_LOCAL_STORAGE is True.")
@@ -35,27 +146,36 @@ def store_signal_batch(signals, signalid, USE_LOCAL_STORAGE, LOCAL_SIGNAL_FOLDER
         filepath = os.path.join(LOCAL_SIGNAL_FOLDER, filename)
         try:
             with open(filepath, "w", encoding="utf-8") as f:
-                json.dump({"signals": signals}, f, indent=2)
+                f.write(document)
             logger.info(f"✅ Saved locally: {filepath}")
         except Exception as e:
             logger.error(f"Local save failed: {e}")
     else:
-        dbx = dropbox.Dropbox(
-            oauth2_refresh_token=DROPBOX_REFRESH_TOKEN,
-            app_key=DROPBOX_APP_KEY,
-            app_secret=DROPBOX_APP_SECRET
-        )
-        if not dbx:
-            raise ValueError("dbx Dropbox client must be provided if USE_LOCAL_STORAGE is False.")
         file_path = f"/{filename}"
-        try:
-            dbx.files_upload(
-                json.dumps({"signals": signals}, indent=2).encode("utf-8"),
+
+        def upload():
+            dropbox_client.get().files_upload(
+                document.encode("utf-8"),
                 file_path,
                 mode=dropbox.files.WriteMode("overwrite"),
             )
+
+        start = time.perf_counter()
+        try:
+            try:
+                upload()
+            except dropbox.exceptions.AuthError:
+                # Token vorzeitig ungültig (z.B. widerrufen): einmal mit frischem Token wiederholen
+                dropbox_client.invalidate_token()
+                upload()
+            upload_latency.observe(time.perf_counter() - start)
             logger.info(f"✅ Uploaded to Dropbox: {file_path}")
+        except BadInputException:
+            # Konfigurationsfehler (fehlende Tokens/App-Key) wie bisher an den Aufrufer
+            raise
         except Exception as e:
+            # Auch Fehler beim Token-Refresh (Netzwerk, HTTP 5xx): loggen wie ein fehlgeschlagener Upload
+            upload_latency.observe(time.perf_counter() - start, ok=False)
             logger.error(f"Dropbox upload failed: {e}")
 
 
@@ -1,13 +1,16 @@
+import asyncio
+import json
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
 import re
-from datetime import datetime
+import unicodedata
 
+import utils
 
-# Die folgende Funktion muss in Ihrer 'utils.py' vorhanden sein
-# from utils import log_skipped_signal
-# Platzhalter für die nicht vorhandene Funktion:
-def log_skipped_signal(reason, text):
-    pass
-    # print(f"[LOG_SKIP] {reason}: {text[:50]}...")
+logger = logging.getLogger("signalworker.filters")
 
 
 # --- GLOBALE KONSTANTEN ---
@@ -39,93 +42,437 @@ UPDATE_PATTERNS: list[str] = [
 ]
 
 
-def should_ignore_message(text: str) -> bool:
-    original_text = text
-    text_lower = text.lower().strip()
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-
-
-    # NEU: Manipulationen müssen frühzeitig erkannt werden, damit der BLACKLIST-Filter sie nicht ignoriert
-    is_pips_manipulation = re.search(r"\+\d+\s*pips", text_lower)
-
-
-    # --- 1. PRE-FILTER: MINIMALE PRÜFUNG AUF HANDELSAKTIVITÄT ---
-    found_required_kw = any(kw.lower() in text_lower for kw in REQUIRED_TRADING_KEYWORDS)
-
-
-    if not found_required_kw and not is_pips_manipulation:
-
-        log_skipped_signal(f"{timestamp} - Ignoring: No core trading keyword found", original_text)
-
-        return True
-
-
-
-    # --- 2. BLACKLIST-PRÜFUNG (MUSS VOR DER WHITELISTING-PRÜFUNG ERFOLGEN) ---
-    for word in BLACKLIST_KEYWORDS:
-        # ROBUSTERE PRÜFUNG: Sucht entweder am Anfang (^) oder an einer Wortgrenze (\b),
-        # gefolgt von beliebigen Leerzeichen, Satzzeichen, etc. ([\s\W]*).
-        pattern = r'(?:^|\b)' + re.escape(word) + r'[\s\W]*'
-
-        match = re.search(pattern, original_text, re.IGNORECASE)
-
-
-        if match:
-
-            log_skipped_signal(f"🛑 Ignoring: matched blacklist keyword '{word}'", original_text)
-
-            return True
-
-
-
-    # --- 3. PRÜFUNG AUF ZWINGENDE TRADING-PARAMETER (WHITELISTING) ---
-
-    # SL Check
-    has_sl_match_1 = re.search(r'\bsl\b[\s:\-]*\d+', text_lower)
-    has_sl_match_2 = re.search(r'stop\s*loss', text_lower)
-    has_sl_match_3 = re.search(r'🟣', text)
-    has_sl = bool(has_sl_match_1 or has_sl_match_2 or has_sl_match_3)
-
-
-    # TP Check
-    has_tp_match_1 = re.search(r'tp\d*[\s:=+\-]*[\$\d\.]+', text_lower)
-    has_tp_match_2 = re.search(r'🟡', text)
-    has_tp_match_3 = re.search(r'\btp\d*[\s:=+\-]*\d+\s*p[ip]*s?\b', text_lower)
-    has_tp_match_4 = re.search(r'take\s*profit', text_lower)
-    has_tp = bool(has_tp_match_1 or has_tp_match_2 or has_tp_match_3 or has_tp_match_4)
-
-
-
-    # Manipulation Check
-    manipulation_cmds = ["close all", "close at entry", "move sl to", "cancel pending", "cancel", "close", "set be", "break even"]
-    has_manipulation_cmd = any(cmd in text_lower for cmd in manipulation_cmds)
-    manipulation_commands_present = has_manipulation_cmd or bool(is_pips_manipulation)
-
-
-
-    # Wenn weder SL/TP noch ein expliziter Manipulationsbefehl vorhanden ist, ignorieren.
-    if not (has_sl or has_tp or manipulation_commands_present):
-
-        log_skipped_signal(f"{timestamp} - Ignoring: missing SL or TP or manipulation commands", original_text)
-
-        return True
-
-
-
-    # --- 4. UPDATE-MUSTER PRÜFUNG (Regex-Muster) ---
-    for i, pattern in enumerate(UPDATE_PATTERNS):
-        match = re.search(pattern, text_lower)
-
-
-        if match and not is_pips_manipulation:
+# --- KOMPILIERTE REGELN ---
+# Jede Regelklasse wird einmal pro Regelversion zu einer einzigen Alternation kompiliert, statt
+# pro Nachricht ~30 Blacklist-Regexe neu zu bauen und die Keyword-Listen linear abzusuchen.
+# Eine gemeinsame Alternation über alle Klassen würde überlappende Treffer verschlucken
+# (z.B. "tp" als Keyword vs. "tp: 2405" als TP-Angabe), daher ein Muster pro Klasse.
+MANIPULATION_COMMANDS: list[str] = [
+    "close all", "close at entry", "move sl to", "cancel pending", "cancel", "close", "set be", "break even"
+]
 
-            log_skipped_signal("Ignored signal: update pattern detected", original_text)
+SL_PATTERNS: list[str] = [r'\bsl\b[\s:\-]*\d+', r'stop\s*loss', r'🟣']
+TP_PATTERNS: list[str] = [
+    r'tp\d*[\s:=+\-]*[\$\d\.]+', r'🟡', r'\btp\d*[\s:=+\-]*\d+\s*p[ip]*s?\b', r'take\s*profit'
+]
 
-            return True
+# Eingebaute Regeln (Version 0); die Regeldatei kann jedes Feld global oder pro Kanal überschreiben.
+BUILTIN_RULES: dict[str, list[str]] = {
+    "required_keywords": REQUIRED_TRADING_KEYWORDS,
+    "blacklist_keywords": BLACKLIST_KEYWORDS,
+    "update_patterns": UPDATE_PATTERNS,
+    "manipulation_commands": MANIPULATION_COMMANDS,
+    "sl_patterns": SL_PATTERNS,
+    "tp_patterns": TP_PATTERNS,
+}
+
+PIPS_MANIPULATION_RE = re.compile(r"\+\d+\s*pips")
+
+# Gründe, aus denen classify_message eine Nachricht verwirft
+REASON_NO_KEYWORD = "no_trading_keyword"
+REASON_BLACKLIST = "blacklist"
+REASON_NO_PARAMETERS = "no_trade_parameters"
+REASON_UPDATE_PATTERN = "update_pattern"
+# Kompakte Codes für filter_batch: REASON_CODES[code], 0 = verarbeiten
+REASON_CODES: tuple[str | None, ...] = (None, REASON_NO_KEYWORD, REASON_BLACKLIST, REASON_NO_PARAMETERS,
+                                        REASON_UPDATE_PATTERN)
+_REASON_TO_CODE = {reason: code for code, reason in enumerate(REASON_CODES)}
+
+
+def _alternation(patterns: list[str], flags: int = 0) -> re.Pattern:
+    return re.compile("|".join(f"(?:{p})" for p in patterns) or "(?!)", flags)
+
+
+def _keyword_alternation(words: list[str], prefix: str = "", flags: int = 0) -> re.Pattern:
+    if not words:
+        return re.compile("(?!)")
+    # Längste Wörter zuerst, damit der Treffer das vollständige Keyword liefert ("results" statt "result").
+    words = sorted({w.lower() for w in words}, key=len, reverse=True)
+    return re.compile(prefix + "(?:" + "|".join(re.escape(w) for w in words) + ")", flags)
+
+
+class RuleSet:
+    """
+    Die kompilierten Regeln einer Version (global oder für einen Kanal).
+    """
+
+    def __init__(self, version, rules: dict[str, list[str]]):
+        self.version = version
+        self.required_re = _keyword_alternation(rules["required_keywords"])
+        # Wie bisher: am Anfang (^) oder an einer Wortgrenze (\b), case-insensitiv auf dem Originaltext.
+        self.blacklist_re = _keyword_alternation(rules["blacklist_keywords"], prefix=r'(?:^|\b)', flags=re.IGNORECASE)
+        self.sl_re = _alternation(rules["sl_patterns"])
+        self.tp_re = _alternation(rules["tp_patterns"])
+        self.manipulation_re = _keyword_alternation(rules["manipulation_commands"])
+        self.update_re = _alternation(rules["update_patterns"])
+
+    def features(self, text: str) -> dict:
+        text_lower = text.lower().strip()
+        blacklisted = self.blacklist_re.search(text)
+        return {
+            "pips_manipulation": bool(PIPS_MANIPULATION_RE.search(text_lower)),
+            "trading_keyword": bool(self.required_re.search(text_lower)),
+            "blacklist": blacklisted.group(0).lower() if blacklisted else None,
+            "sl": bool(self.sl_re.search(text_lower)),
+            "tp": bool(self.tp_re.search(text_lower)),
+            "manipulation": bool(self.manipulation_re.search(text_lower)),
+            "update_pattern": bool(self.update_re.search(text_lower)),
+        }
+
+    def classify(self, text: str) -> tuple[str | None, str | None]:
+        """
+        (REASON_*, Blacklist-Keyword) oder (None, None). Gleiche Reihenfolge und Semantik wie
+        die ursprünglichen Einzelprüfungen, mit frühem Abbruch.
+        """
+        text_lower = text.lower().strip()
+
+        # NEU: Manipulationen müssen frühzeitig erkannt werden, damit der BLACKLIST-Filter sie nicht ignoriert
+        is_pips_manipulation = PIPS_MANIPULATION_RE.search(text_lower) is not None
+
+        # --- 1. PRE-FILTER: MINIMALE PRÜFUNG AUF HANDELSAKTIVITÄT ---
+        if not is_pips_manipulation and self.required_re.search(text_lower) is None:
+            return REASON_NO_KEYWORD, None
+
+        # --- 2. BLACKLIST-PRÜFUNG (MUSS VOR DER WHITELISTING-PRÜFUNG ERFOLGEN) ---
+        blacklisted = self.blacklist_re.search(text)
+        if blacklisted:
+            return REASON_BLACKLIST, blacklisted.group(0).lower()
+
+        # --- 3. PRÜFUNG AUF ZWINGENDE TRADING-PARAMETER (WHITELISTING) ---
+        # Wenn weder SL/TP noch ein expliziter Manipulationsbefehl vorhanden ist, ignorieren.
+        if not (is_pips_manipulation or self.sl_re.search(text_lower) or self.tp_re.search(text_lower)
+                or self.manipulation_re.search(text_lower)):
+            return REASON_NO_PARAMETERS, None
+
+        # --- 4. UPDATE-MUSTER PRÜFUNG (Regex-Muster) ---
+        if not is_pips_manipulation and self.update_re.search(text_lower):
+            return REASON_UPDATE_PATTERN, None
+
+        return None, None
+
+
+# --- REGELDATEI (versioniert, pro Kanal, Hot-Reload) ---
+# {
+#   "version": 3,
+#   "defaults": {"blacklist_keywords": {"add": ["vip results"]}},
+#   "sources": {
+#     "Gold Signals VIP": {"blacklist_keywords": {"remove": ["session"]}},
+#     "Forex Pro Signals": {"update_patterns": ["\\bsl\\s+was\\s+hit\\b"]}
+#   }
+# }
+# Eine Liste ersetzt das Feld, {"add": [...], "remove": [...]} ändert es. "sources" setzt auf
+# den (ggf. geänderten) Defaults auf; Schlüssel ist der Kanaltitel. Eine geänderte Datei wird
+# nur übernommen, wenn sich "version" geändert hat.
+RULES_FILE = os.getenv("MESSAGE_FILTER_RULES", "filter_rules.json")
+RULES_RELOAD_INTERVAL = float(os.getenv("MESSAGE_FILTER_RELOAD_INTERVAL", "5"))
+
+
+class FilterRules:
+    """
+    Alle kompilierten Regeln einer Version: Defaults plus ein RuleSet pro überschriebenem Kanal.
+    """
+
+    def __init__(self, version, default: RuleSet, sources: dict[str, RuleSet] = None, mtime_ns: int | None = None):
+        self.version = version
+        self.default = default
+        self.sources = sources or {}
+        self.mtime_ns = mtime_ns
+
+    def for_source(self, source: str | None) -> RuleSet:
+        return self.sources.get(source, self.default)
+
+
+def _string_list(value, where: str) -> list[str]:
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"{where} must be a list of strings")
+    return list(value)
+
+
+def _merge_rules(base: dict[str, list[str]], overrides, where: str) -> dict[str, list[str]]:
+    if not isinstance(overrides, dict):
+        raise ValueError(f"{where} must be an object of rule fields")
+    merged = dict(base)
+    for field, value in overrides.items():
+        if field not in BUILTIN_RULES:
+            raise ValueError(f"unknown filter rule field '{field}' in {where}")
+        if isinstance(value, list):
+            merged[field] = _string_list(value, f"{where}.{field}")
+        elif isinstance(value, dict):
+            unknown = set(value) - {"add", "remove"}
+            if unknown:
+                raise ValueError(f"{where}.{field} allows only 'add'/'remove', got {sorted(unknown)}")
+            removed = set(_string_list(value.get("remove", []), f"{where}.{field}.remove"))
+            added = _string_list(value.get("add", []), f"{where}.{field}.add")
+            merged[field] = [item for item in merged[field] if item not in removed] + added
+        else:
+            raise ValueError(f"{where}.{field} must be a list or an add/remove object")
+    return merged
+
+
+def _compile_rule_set(version, rules: dict[str, list[str]], where: str) -> RuleSet:
+    try:
+        return RuleSet(version, rules)
+    except re.error as e:
+        raise ValueError(f"invalid pattern in {where}: {e}") from e
+
+
+def compile_rules(config: dict, mtime_ns: int | None = None) -> FilterRules:
+    """
+    Kompiliert eine Regelkonfiguration (Format siehe oben). Wirft ValueError bei falschen Typen,
+    unbekannten Feldern oder ungültigen Mustern.
+    """
+    if not isinstance(config, dict):
+        raise ValueError("filter rules must be a JSON object")
+    version = config.get("version", 0)
+    if not isinstance(version, (int, str)) or isinstance(version, bool):
+        raise ValueError("'version' must be a number or a string")
+    sources = config.get("sources", {})
+    if not isinstance(sources, dict):
+        raise ValueError("'sources' must be an object keyed by channel title")
+    defaults = _merge_rules(BUILTIN_RULES, config.get("defaults", {}), "defaults")
+    return FilterRules(
+        version,
+        _compile_rule_set(version, defaults, "defaults"),
+        {
+            source: _compile_rule_set(version, _merge_rules(defaults, overrides, f"sources.{source}"),
+                                      f"sources.{source}")
+            for source, overrides in sources.items()
+        },
+        mtime_ns,
+    )
+
+
+def load_rules(path: str) -> FilterRules:
+    mtime_ns = os.stat(path).st_mtime_ns
+    with open(path, encoding="utf-8") as f:
+        return compile_rules(json.load(f), mtime_ns)
+
+
+def _initial_rules() -> FilterRules:
+    if RULES_FILE and os.path.exists(RULES_FILE):
+        try:
+            return load_rules(RULES_FILE)
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Filter rules {RULES_FILE} invalid, using built-in rules: {e}")
+    return compile_rules({})
+
+
+# Wird nur als Ganzes ersetzt (eine Zuweisung): Leser sehen immer eine vollständige Version.
+_rules = _initial_rules()
+
+
+def active_rules() -> FilterRules:
+    return _rules
+
+
+async def _watch_rules(path: str, interval: float):
+    seen_mtime = _rules.mtime_ns
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            seen_mtime = await _reload_rules(path, seen_mtime)
+        except Exception:
+            # Eine fehlerhafte Version darf das Neuladen späterer Versionen nie beenden
+            logger.exception(f"❌ Filter rules reload of {path} failed, keeping version {_rules.version}")
+
+
+async def _reload_rules(path: str, seen_mtime: int | None) -> int | None:
+    """
+    Loads and swaps in the rule file if it changed since seen_mtime; returns the mtime handled.
+    """
+    global _rules
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return seen_mtime  # bleibt bei den aktuellen Regeln
+    if mtime_ns == seen_mtime:
+        return seen_mtime
+    try:
+        # Lesen und Kompilieren im Thread: der Nachrichtenpfad läuft mit der alten Version weiter
+        rules = await asyncio.to_thread(load_rules, path)
+    except (OSError, ValueError) as e:
+        logger.error(f"❌ Filter rules {path} invalid, keeping version {_rules.version}: {e}")
+        return mtime_ns
+    if rules.version == _rules.version:
+        logger.warning(f"Filter rules {path} changed without a new version ({rules.version}), ignored")
+        return mtime_ns
+    logger.info(f"🔁 Filter rules version {_rules.version} -> {rules.version} "
+                f"({len(rules.sources)} channel overrides)")
+    _rules = rules
+    return mtime_ns
+
+
+def start_filter_reload() -> asyncio.Task | None:
+    """
+    Starts watching the rule file on the running event loop (call once at startup).
+    """
+    if not RULES_FILE or RULES_RELOAD_INTERVAL <= 0:
+        return None
+    return asyncio.create_task(_watch_rules(RULES_FILE, RULES_RELOAD_INTERVAL), name="filter-rules-reload")
+
+
+def message_features(text: str, source: str = None) -> dict:
+    """
+    Alle Klassifikationsmerkmale einer Nachricht (ein kompiliertes Muster pro Regelklasse).
+    """
+    return _rules.for_source(source).features(text)
+
+
+def classify_message(text: str, source: str = None) -> str | None:
+    """
+    Grund (REASON_*), aus dem die Nachricht ignoriert wird, oder None wenn sie verarbeitet werden soll.
+    Der Text wird vorher NFKC-normalisiert (Kanäle schreiben Signale auch als 𝗦𝗟 2660).
+    """
+    return _rules.for_source(source).classify(unicodedata.normalize("NFKC", text))[0]
+
+
+# --- BATCH-KLASSIFIKATION (historische Exporte) ---
+# Ab dieser Anzahl Nachrichten verteilt filter_batch auf einen Prozesspool (0 = nie).
+FILTER_BATCH_POOL_THRESHOLD = int(os.getenv("FILTER_BATCH_POOL_THRESHOLD", "20000"))
+FILTER_BATCH_CHUNK_SIZE = 2000
+
+_worker_rules: RuleSet | None = None
+
+
+def _init_batch_worker(rules: RuleSet):
+    # Einmal pro Prozess: die Muster werden beim Entpickeln kompiliert, nicht pro Chunk
+    global _worker_rules
+    _worker_rules = rules
+
+
+def _classify_chunk(texts: list[str], rules: RuleSet = None) -> bytes:
+    rules = rules or _worker_rules
+    return bytes(_REASON_TO_CODE[rules.classify(unicodedata.normalize("NFKC", text))[0]] for text in texts)
+
+
+def _pool_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def filter_batch(texts: list[str], source: str = None, processes: int | None = None) -> array:
+    """
+    Klassifiziert eine ganze Liste mit einem gemeinsamen RuleSet. Ergebnis: array('B') mit
+    einem Code pro Text (REASON_CODES[code], 0 = verarbeiten). processes > 1 erzwingt einen
+    Prozesspool, 0/1 die Verarbeitung im Prozess; None entscheidet nach FILTER_BATCH_POOL_THRESHOLD.
+    """
+    rules = _rules.for_source(source)
+    if processes is None:
+        use_pool = 0 < FILTER_BATCH_POOL_THRESHOLD <= len(texts)
+        processes = os.cpu_count() or 1
+    else:
+        use_pool = processes > 1
+    codes = array("B")
+    if not use_pool or processes <= 1:
+        codes.frombytes(_classify_chunk(texts, rules))
+        return codes
+    chunks = [texts[i:i + FILTER_BATCH_CHUNK_SIZE] for i in range(0, len(texts), FILTER_BATCH_CHUNK_SIZE)]
+    # forkserver statt fork: der Aufrufer hat weitere Threads (Journal, DB-Executor, Telethon,
+    # asyncio.to_thread), und ein fork mit fremden gehaltenen Locks kann im Kind hängen bleiben.
+    with ProcessPoolExecutor(max_workers=min(processes, len(chunks)), mp_context=_pool_context(),
+                             initializer=_init_batch_worker, initargs=(rules,)) as pool:
+        for chunk_codes in pool.map(_classify_chunk, chunks):
+            codes.frombytes(chunk_codes)
+    return codes
 
 
-    return False
+def should_ignore_message(text: str) -> bool:
+    reason, keyword = _rules.default.classify(text)
+    if reason is None:
+        return False
+
+    # Das Skip-Log (JSON) schreibt gate_message; hier nur Debug-Ausgabe
+    logger.debug(f"Ignoring message ({reason}{f': {keyword}' if keyword else ''}): {text[:50]!r}")
+    return True
+
+
+# --- PIPELINE-STUFE VOR DEM SANITIZER ---
+# enforce: verworfene Nachrichten erreichen weder Signal-DB noch Sanitizer (LLM)
+# shadow:  Entscheidung nur zählen und loggen, alles wird weiter verarbeitet (Standard, bis
+#          shadow_dropped_with_signals zeigt, dass der Filter für die Kanäle keine Signale verwirft)
+# off:     kein Filter
+FILTER_MODE = os.getenv("MESSAGE_FILTER_MODE", "shadow").lower()
+SKIP_LOG_FILE = os.getenv("MESSAGE_FILTER_SKIP_LOG", "skipped_signals.log")
+
+
+class FilterStats:
+    """
+    Per-channel counters of the filter stage: messages seen and dropped (or, in shadow mode,
+    that would have been dropped), LLM calls avoided, the estimated latency saved, and in
+    shadow mode how many would-be drops the sanitizer still found signals in.
+    """
+
+    def __init__(self):
+        self.channels: dict[str, dict] = {}
+
+    def _channel(self, source: str) -> dict:
+        return self.channels.setdefault(source or "unknown", {
+            "seen": 0, "dropped": 0, "shadow_dropped": 0, "shadow_dropped_with_signals": 0,
+            "llm_calls_avoided": 0, "latency_saved_s": 0.0, "reasons": {},
+        })
+
+    def record(self, source: str, reason: str | None, enforced: bool, llm_latency: float):
+        channel = self._channel(source)
+        channel["seen"] += 1
+        if reason is None:
+            return
+        channel["reasons"][reason] = channel["reasons"].get(reason, 0) + 1
+        if enforced:
+            channel["dropped"] += 1
+            channel["llm_calls_avoided"] += 1
+            channel["latency_saved_s"] += llm_latency
+        else:
+            channel["shadow_dropped"] += 1
+
+    def record_shadow_outcome(self, source: str, found_signals: bool):
+        if found_signals:
+            self._channel(source)["shadow_dropped_with_signals"] += 1
+
+    def report(self) -> dict[str, dict]:
+        report = {}
+        for source, channel in self.channels.items():
+            report[source] = dict(channel, drop_rate=round(
+                (channel["dropped"] + channel["shadow_dropped"]) / channel["seen"], 3) if channel["seen"] else None)
+        return report
+
+
+filter_stats = FilterStats()
+
+
+def gate_message(text: str, source: str = None, link: str = None, llm_latency: float = 2.0) -> tuple[bool, str | None]:
+    """
+    Filter stage for new (non-reply) messages. Returns (drop, reason): drop is True only in
+    enforce mode; reason is the REASON_* the filter matched (also in shadow mode), else None.
+    llm_latency is the current estimate of one sanitizer LLM call, for the latency saved.
+    """
+    if FILTER_MODE == "off":
+        return False, None
+    rules = _rules.for_source(source)
+    reason, keyword = rules.classify(unicodedata.normalize("NFKC", text))
+    _record_decision(text, reason, source, link, llm_latency, rules.version, keyword)
+    return FILTER_MODE == "enforce" and reason is not None, reason
+
+
+def record_batch_drops(texts: list[str], codes: array, source: str = None, links: list[str] = None,
+                       llm_latency: float = 2.0):
+    """
+    Zählt und loggt die von filter_batch verworfenen Texte wie gate_message (nur enforce-Modus;
+    die übrigen durchlaufen danach den Handler und werden dort gezählt).
+    """
+    version = _rules.for_source(source).version
+    for index, code in enumerate(codes):
+        if code:
+            _record_decision(texts[index], REASON_CODES[code], source, links[index] if links else None,
+                             llm_latency, version)
+
+
+def _record_decision(text, reason, source, link, llm_latency, rules_version, keyword=None):
+    filter_stats.record(source, reason, FILTER_MODE == "enforce", llm_latency)
+    if reason is not None:
+        # Läuft auf dem Event-Loop: die Datei schreibt der QueueListener-Thread
+        utils.queued_file_logger("signalworker.filters.skipped", SKIP_LOG_FILE).info(
+            utils.skipped_signal_entry(reason, text, mode=FILTER_MODE, rules_version=rules_version,
+                                       source=source, link=link, keyword=keyword))
 
 
 # Beispiel-Aufruf mit Debug-Meldungen:
@@ -11,6 +11,11 @@ import aiofiles
 
 # Importiere zentrale Logik aus den Modulen
 from handlers import register_handlers
+from signal_db_async import flush as flush_signal_db
+from sanitizer import sanitizer_cache, fast_path_stats, prime_sanitizer, clear_primed, provider_pool, compaction_stats
+from llm_scheduler import llm_priority, PRIORITY_BACKFILL
+from dropbox_writer import upload_latency
+from filters import filter_stats, filter_batch, record_batch_drops, FILTER_MODE
 
 # Hinweis: 'sanitizer' und 'signal_processor' müssen hier nicht importiert werden,
 # da sie bereits von 'handlers.py' importiert und verwendet werden.
@@ -113,6 +118,26 @@ async def fetch_channel_history(client: TelegramClient, channel_id: str | int, l
     return messages
 
 
+async def filter_historical_messages(messages: list) -> list:
+    """
+    Klassifiziert alle neuen (Nicht-Antwort-)Nachrichten mit filters.filter_batch und gibt nur die
+    Überlebenden (plus alle Antworten) zurück; Verworfene werden gezählt und geloggt.
+    """
+    candidates = [m for m in messages if not getattr(m, 'is_reply', False)]
+    if not candidates:
+        return messages
+    source = getattr(candidates[0].chat, 'title', 'unknown_chat')
+    texts = [getattr(m, 'raw_text', None) or getattr(m, 'message', '') or '' for m in candidates]
+    # Im Thread: große Exporte laufen im Prozesspool, die Event-Loop bleibt frei
+    codes = await asyncio.to_thread(filter_batch, texts, source)
+    links = [f"https://t.me/c/{abs(m.chat_id or 0)}/{m.id}" for m in candidates]
+    record_batch_drops(texts, codes, source=source, links=links, llm_latency=fast_path_stats.llm_latency_avg)
+
+    dropped = {id(m) for m, code in zip(candidates, codes) if code}
+    print(f"🧹 Filter: {len(dropped)} von {len(candidates)} neuen Nachrichten verworfen.")
+    return [m for m in messages if id(m) not in dropped]
+
+
 async def replay_historical_messages(client: TelegramClient, messages: list):
     """
     Spielt historische Nachrichten ab, indem NewMessage-Events simuliert werden.
@@ -125,6 +150,19 @@ async def replay_historical_messages(client: TelegramClient, messages: list):
     # Greift auf die registrierte Handler-Funktion in handlers.py zu
     handler = client._event_builders[0][1]
 
+    # Historische Exporte in einem Durchgang filtern: nur die Überlebenden gehen an Sanitizer/LLM
+    if FILTER_MODE == "enforce":
+        messages = await filter_historical_messages(messages)
+
+    # Neue Signale vorab gebündelt über das LLM extrahieren (Antworten laufen weiter einzeln)
+    to_prime = [
+        (message.id, getattr(message, 'raw_text', None) or getattr(message, 'message', '') or '')
+        for message in messages
+        if not getattr(message, 'is_reply', False)
+    ]
+    primed = await prime_sanitizer([(msg_id, text) for msg_id, text in to_prime if text])
+    print(f"🧺 {primed} Nachrichten/Signalblöcke gebündelt vorab extrahiert.")
+
     for message in messages:
         # Extrahiere den Nachrichtentext robust
         msg_text = getattr(message, 'raw_text', None) or getattr(message, 'message', '') or ''
@@ -147,6 +185,11 @@ async def replay_historical_messages(client: TelegramClient, messages: list):
         # Ruft den Handler in handlers.py auf, um das Signal zu verarbeiten
         await handler(dummy_event)
 
+    # Nicht abgeholte Vorab-Ergebnisse (z.B. Handler-Fehler) nicht über den Replay hinaus halten
+    unused = clear_primed()
+    if unused:
+        print(f"⚠️ {unused} vorab extrahierte Ergebnisse wurden nicht verwendet.")
+
 
 # --- ARGS PARSING (unverändert) ---
 
@@ -198,6 +241,8 @@ def parse_args():
 
 async def main(channel_id: str | int, min_date: datetime | None = None, max_date: datetime | None = None):
     client = get_client()
+    # Alle LLM-Aufrufe dieses Skripts sind Backfill: Live-Signale des Workers haben Vorrang.
+    llm_priority.set(PRIORITY_BACKFILL)
 
     # Verbindungsversuch (Verwendet optional das 2FA-Passwort)
     await client.start(password=TELEGRAM_PASSWORD)
@@ -212,7 +257,16 @@ async def main(channel_id: str | int, min_date: datetime | None = None, max_date
     if messages:
         print("▶️ Beginne Wiedergabe historischer Nachrichten...")
         await replay_historical_messages(client, messages)
+        # Gepufferte Einträge (Write-Behind-Journal) vor dem Beenden dauerhaft schreiben
+        await flush_signal_db()
         print("✅ Wiedergabe abgeschlossen.")
+        print(f"LLM-Cache: {sanitizer_cache.stats()}")
+        print(f"Fast-Path: {fast_path_stats.report()}")
+        print(f"LLM-Provider: {provider_pool.stats()}")
+        print(f"Prompt-Kompaktierung: {compaction_stats.report()}")
+        print(f"Filter ({FILTER_MODE}): {filter_stats.report()}")
+        if upload_latency.count:
+            print(f"Dropbox-Uploads: {upload_latency.report()}")
 
     # run_until_disconnected() ist hier nicht nötig, da das Skript nach der Wiedergabe beendet werden soll.
     # Wenn Sie nach der Wiedergabe in den Live-Modus wechseln möchten, fügen Sie es hinzu.
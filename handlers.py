@@ -1,12 +1,12 @@
 # handlers.py
 
 import logging
+import uuid
 from telethon import events
-from sanitizer import sanitize_signal
+from sanitizer import sanitize_signal, fast_path_stats
 from signal_processor import process_sanitized_signal
-# WICHTIG: Stellen Sie sicher, dass diese Imports vorhanden sind!
-from filters import should_ignore_message  # Die korrigierte Funktion
-from signal_db import get_signalid, store_signalid
+from filters import gate_message, filter_stats
+from signal_db_async import get_or_create_signalid
 from datetime import datetime
 
 logger = logging.getLogger("signalworker.handlers")
@@ -19,8 +19,6 @@ def register_handlers(client, source_channels, is_historical=False):
         if not text:
             return
 
-        # ... (Filter, Kontext-Extraktion)
-
         is_reply = event.message.is_reply
         reply_to_msg_id = event.message.reply_to_msg_id
         telegram_message_id = event.id
@@ -29,18 +27,26 @@ def register_handlers(client, source_channels, is_historical=False):
         link = f"https://t.me/c/{abs(event.chat_id)}/{event.id}"
         timestamp = str(event.message.date)
 
+        # --- 1. FILTER (vor Signal-ID und LLM) ---
+        # Antworten (Manipulationen) werden ohne LLM ausgewertet und daher nicht gefiltert.
+        filter_reason = None
+        if not is_reply:
+            drop, filter_reason = gate_message(text, source=source_title, link=link,
+                                               llm_latency=fast_path_stats.llm_latency_avg)
+            if drop:
+                logger.info(f"Message {telegram_message_id} from {source_title} dropped by filter: {filter_reason}")
+                return
+
         # --- 2. ID MANAGEMENT (KRITISCHER FIX) ---
         main_signalid = None
 
         if is_reply and reply_to_msg_id:
             # Szenario A: Manipulation (Antwort auf ein anderes Signal)
-            main_signalid = get_signalid(reply_to_msg_id)
-
-            if not main_signalid:
-                # KRITISCHER FIX: Wenn die ID des Originals NICHT gefunden wird,
-                # erstellen wir sie JETZT nachträglich anhand der Original-Nachrichten-ID.
-                main_signalid = store_signalid(reply_to_msg_id)
+            # Atomar: vorhandene ID des Originals holen oder JETZT nachträglich anlegen.
+            candidate_signalid = str(uuid.uuid4())
+            main_signalid = await get_or_create_signalid(reply_to_msg_id, default=candidate_signalid)
 
+            if main_signalid == candidate_signalid:
                 # Wenn wir hier sind, bedeutet das, dass das Originalsignal nicht
                 # als "neues Signal" gespeichert wurde oder die DB-Synchronisation fehlschlug.
                 logger.warning(
@@ -48,41 +54,46 @@ def register_handlers(client, source_channels, is_historical=False):
 
             # Die aktuelle Nachricht (Manipulation) muss auch zur Haupt-Signal-ID zugeordnet werden
             # (falls sie noch nicht existiert), aber die main_signalid ist die ID des Originals.
-            if telegram_message_id and get_signalid(telegram_message_id) is None:
-                store_signalid(telegram_message_id, main_signalid)
+            if telegram_message_id:
+                await get_or_create_signalid(telegram_message_id, default=main_signalid)
 
 
         elif telegram_message_id:
             # Szenario B: Neues Signal (Keine Antwort)
-            main_signalid = get_signalid(telegram_message_id) or store_signalid(telegram_message_id)
+            main_signalid = await get_or_create_signalid(telegram_message_id)
 
         # Dies ist die finale Prüfung, falls get/store_signalid fehlschlägt.
         if not main_signalid:
             logger.error(f"Failed to determine signal ID for message ID {telegram_message_id}.")
             return
 
-        # --- 3. Sanitizing (unverändert) ---
+        # --- 3. + 4. Sanitizing und Processing ---
+        # Jede Idee wird verarbeitet, sobald sie fertig gestreamt ist (nicht erst nach der ganzen Antwort).
+        async def process_signals(signals):
+            await process_sanitized_signal(
+                {"signals": signals},
+                source=source_title,
+                link=link,
+                timestamp=timestamp,
+                telegram_message_id=telegram_message_id,
+                reply_to_msg_id=reply_to_msg_id,
+                override_signalid=main_signalid,
+                is_historical=is_historical
+            )
+
         sanitized = await sanitize_signal(
             signal_text=text,
             is_reply=is_reply,
             main_signalid=main_signalid,
             link=link,
-            source=source_title
+            source=source_title,
+            on_signals=process_signals
         )
 
+        if filter_reason:
+            # Shadow-Modus: hätte der Filter hier ein echtes Signal verworfen?
+            filter_stats.record_shadow_outcome(source_title, bool(sanitized and sanitized.get("signals")))
+
         # Optional: Prüfung auf leeres sanitized JSON (falls sanitize_signal leer zurückgibt)
         if not sanitized or not isinstance(sanitized, dict) or not any(sanitized.values()):
             logger.warning(f"Sanitizer returned empty data for signal ID {main_signalid}. Message ignored.")
-            return
-
-        # --- 4. Processing (unverändert) ---
-        await process_sanitized_signal(
-            sanitized,
-            source=source_title,
-            link=link,
-            timestamp=timestamp,
-            telegram_message_id=telegram_message_id,
-            reply_to_msg_id=reply_to_msg_id,
-            override_signalid=main_signalid,
-            is_historical=is_historical
-        )
\ No newline at end of file
@@ -0,0 +1,70 @@
+# json_stream.py
+"""
+Incremental extraction of JSON objects from text that arrives in pieces.
+
+LLM answers are streamed token by token and may wrap the JSON in code fences,
+prose, a top-level array or several concatenated objects. JsonObjectStream tracks
+strings, escapes and brace depth over everything fed so far and returns every
+object as soon as its closing brace arrives, including objects nested in other
+objects or arrays (innermost first).
+"""
+import json
+import logging
+
+logger = logging.getLogger("signalworker.json_stream")
+
+
+class JsonObjectStream:
+    def __init__(self):
+        self._buffer = []      # characters of the currently open outermost object
+        self._starts = []      # buffer offsets of the open objects, outermost first
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> list:
+        """
+        Consumes the next piece of text and returns the objects it completed.
+        """
+        completed = []
+        for char in chunk:
+            if not self._starts:
+                if char == "{":
+                    self._starts.append(0)
+                    self._buffer = ["{"]
+                continue  # text between top-level objects is ignored
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._starts.append(len(self._buffer) - 1)
+            elif char == "}":
+                start = self._starts.pop()
+                text = "".join(self._buffer[start:])
+                try:
+                    completed.append(json.loads(text))
+                except json.JSONDecodeError as e:
+                    logger.warning(f"⚠️ Failed to parse JSON object: {e}. Object: {text[:50]}...")
+                if not self._starts:
+                    self._buffer = []
+        return completed
+
+    @property
+    def pending(self) -> bool:
+        """
+        True while an object has been opened but not closed.
+        """
+        return bool(self._starts)
+
+
+def iter_objects(text: str) -> list:
+    """
+    All JSON objects in a complete text, innermost first.
+    """
+    return JsonObjectStream().feed(text)
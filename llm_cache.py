@@ -0,0 +1,150 @@
+# llm_cache.py
+"""
+Persistent, content-addressed cache of LLM sanitization results.
+
+The same signal text is reposted across channels, edited, and replayed by
+get_historical_signals.py, and every LLM round trip is paid and slow. Parsed ideas
+are stored in SQLite under a hash of the normalized message text, the prompt
+version and the model, so a changed prompt or model never serves stale results.
+Entries are evicted when older than LLM_CACHE_MAX_AGE or when the cache exceeds
+LLM_CACHE_MAX_ENTRIES (least recently hit first).
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from signal_db import ConnectionManager
+
+logger = logging.getLogger("signalworker.llm_cache")
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("true", "1", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_MAX_AGE = float(os.getenv("LLM_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+# Eviction runs every this many writes instead of on every write.
+LLM_CACHE_EVICT_EVERY = 100
+
+SQL_CREATE = """
+    CREATE TABLE IF NOT EXISTS sanitizer_cache (
+        key TEXT PRIMARY KEY,
+        ideas TEXT NOT NULL,
+        latency REAL NOT NULL,   -- seconds the LLM call took when the entry was created
+        created_at REAL NOT NULL,
+        last_hit REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )
+"""
+SQL_GET = "SELECT ideas, latency, created_at FROM sanitizer_cache WHERE key = ?"
+SQL_TOUCH = "UPDATE sanitizer_cache SET last_hit = ?, hits = hits + 1 WHERE key = ?"
+SQL_PUT = """
+    INSERT OR REPLACE INTO sanitizer_cache (key, ideas, latency, created_at, last_hit)
+    VALUES (?, ?, ?, ?, ?)
+"""
+SQL_DELETE_EXPIRED = "DELETE FROM sanitizer_cache WHERE created_at < ?"
+SQL_DELETE_LRU = """
+    DELETE FROM sanitizer_cache WHERE key IN (
+        SELECT key FROM sanitizer_cache ORDER BY last_hit LIMIT max(0, (SELECT count(*) FROM sanitizer_cache) - ?)
+    )
+"""
+
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form of a message for cache keys: Unicode NFC, per-line whitespace
+    collapsed, blank lines and surrounding whitespace dropped.
+    """
+    text = unicodedata.normalize("NFC", text)
+    lines = (re.sub(r"\s+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def make_key(text: str, prompt_version: str, model: str) -> str:
+    payload = "\0".join((normalize_text(text), prompt_version, model))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SanitizerCache:
+    """
+    SQLite-backed map of cache key -> list of parsed idea dicts, with hit statistics.
+    Blocking; call from a worker thread when on the event loop.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 max_age: float = LLM_CACHE_MAX_AGE):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._manager = ConnectionManager(path)
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+
+    def _connection(self):
+        conn = self._manager.connection()
+        if not self._initialized:
+            with conn:
+                conn.execute(SQL_CREATE)
+            self._initialized = True
+        return conn
+
+    def get(self, key: str) -> list[dict] | None:
+        conn = self._connection()
+        row = conn.execute(SQL_GET, (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.max_age and now - row[2] > self.max_age):
+            with self._lock:
+                self.misses += 1
+            return None
+        with conn:
+            conn.execute(SQL_TOUCH, (now, key))
+        with self._lock:
+            self.hits += 1
+            self.saved_latency += row[1]
+        return json.loads(row[0])
+
+    def contains(self, key: str) -> bool:
+        """
+        True if a live entry exists; does not count as a hit or miss.
+        """
+        row = self._connection().execute(SQL_GET, (key,)).fetchone()
+        return row is not None and not (self.max_age and time.time() - row[2] > self.max_age)
+
+    def put(self, key: str, ideas: list[dict], latency: float):
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.execute(SQL_PUT, (key, json.dumps(ideas, ensure_ascii=False), latency, now, now))
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % LLM_CACHE_EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        conn = self._connection()
+        with conn:
+            removed = conn.execute(SQL_DELETE_EXPIRED, (time.time() - self.max_age,)).rowcount if self.max_age else 0
+            removed += conn.execute(SQL_DELETE_LRU, (self.max_entries,)).rowcount
+        if removed:
+            logger.info(f"Evicted {removed} sanitizer cache entries.")
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "saved_latency_s": round(self.saved_latency, 3),
+            }
+
+    def close(self):
+        self._manager.close_all()
@@ -0,0 +1,361 @@
+# llm_providers.py
+"""
+Pool of OpenAI-compatible LLM providers with hedged requests and circuit breakers.
+
+A live signal must not wait for one slow provider until its timeout. Each request
+goes to the preferred healthy provider; if no answer arrives within that provider's
+recent p95 latency, a second (hedged) request is sent to the next provider, and the
+first valid answer wins while the other request is cancelled. Errors fail over to the
+next provider immediately. A provider that keeps failing is skipped by its circuit
+breaker for AI_BREAKER_COOLDOWN seconds, after which a single probe request decides
+whether it is used again.
+
+Providers are configured with AI_PROVIDERS, a JSON list such as
+[{"name": "groq", "base_url": "https://api.groq.com/openai/v1", "model": "llama-3.3-70b-versatile",
+  "api_key_env": "GROQ_API_KEY", "rpm": 30, "tpm": 6000}, ...]; the list order is the order of
+preference, rpm/tpm are optional (see llm_scheduler.py).
+Without AI_PROVIDERS the pool consists of the single AI_BASE_URL/AI_MODEL provider
+(hedges then go to the same provider over a second connection).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque
+
+from openai import AsyncOpenAI, RateLimitError
+
+from llm_scheduler import RateLimitScheduler, count_tokens, AI_RPM, AI_TPM, AI_OUTPUT_TOKENS_ESTIMATE
+
+logger = logging.getLogger("signalworker.llm_providers")
+
+AI_PROVIDERS = os.getenv("AI_PROVIDERS", "")
+# Hedge after this percentile of the provider's recent latencies ...
+AI_HEDGE_QUANTILE = float(os.getenv("AI_HEDGE_QUANTILE", "0.95"))
+# ... but never sooner than this, and after this fixed delay while there are too few samples.
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", "0.5"))
+AI_HEDGE_DEFAULT_DELAY = float(os.getenv("AI_HEDGE_DEFAULT_DELAY", "2.0"))
+AI_HEDGE_MIN_SAMPLES = 20
+AI_LATENCY_WINDOW = 200
+# Consecutive failures that open a provider's breaker, and how long it stays open.
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "3"))
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", "30"))
+# 429s are retried on the same provider after the pause the scheduler derives from the headers.
+AI_RATE_LIMIT_RETRIES = int(os.getenv("AI_RATE_LIMIT_RETRIES", "2"))
+
+
+class LatencyTracker:
+    """
+    Sliding window of successful request latencies (seconds).
+    """
+
+    def __init__(self, window: int = AI_LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failures` consecutive failures; open -> half_open after
+    `cooldown` seconds, where one probe request closes it again or re-opens it.
+    """
+
+    def __init__(self, failures: int = AI_BREAKER_FAILURES, cooldown: float = AI_BREAKER_COOLDOWN):
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+
+    def available(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self._probing
+
+    def on_attempt(self):
+        if self.state == "open" and self.available():
+            self.state = "half_open"
+        if self.state == "half_open":
+            self._probing = True
+
+    def on_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def on_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.max_failures):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.opens += 1
+            logger.warning(f"Circuit breaker opened after {self.failures} failures.")
+
+    def on_cancel(self):
+        self._probing = False
+
+
+class Provider:
+    def __init__(self, name: str, base_url: str, model: str, api_key: str, max_concurrency: int,
+                 rpm: float = AI_RPM, tpm: float = AI_TPM):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        # One client per provider: its connection pool stays warm between calls. No SDK retries:
+        # 429s go through the scheduler, other errors fail over in ProviderPool.
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.scheduler = RateLimitScheduler(name, max_concurrency, rpm=rpm, tpm=tpm)
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+        self.requests = 0
+        self.errors = 0
+
+    def hedge_delay(self, timeout: float) -> float:
+        if len(self.latency) < AI_HEDGE_MIN_SAMPLES:
+            delay = AI_HEDGE_DEFAULT_DELAY
+        else:
+            delay = max(AI_HEDGE_MIN_DELAY, self.latency.percentile(AI_HEDGE_QUANTILE))
+        return min(delay, timeout / 2)
+
+    def stats(self) -> dict:
+        p50, p95 = self.latency.percentile(0.5), self.latency.percentile(0.95)
+        return {
+            "model": self.model,
+            "requests": self.requests,
+            "errors": self.errors,
+            "p50_ms": round(p50 * 1e3) if p50 is not None else None,
+            "p95_ms": round(p95 * 1e3) if p95 is not None else None,
+            "breaker": self.breaker.state,
+            "breaker_opens": self.breaker.opens,
+            "scheduler": self.scheduler.stats(),
+        }
+
+
+class ProviderPool:
+    """
+    Sends chat completions through the configured providers with hedging and failover.
+    Every attempt (hedges included) is admitted by its provider's RateLimitScheduler.
+    """
+
+    def __init__(self, providers: list[Provider]):
+        if not providers:
+            raise ValueError("ProviderPool needs at least one provider")
+        self.providers = providers
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def _candidates(self) -> list[Provider]:
+        healthy = [p for p in self.providers if p.breaker.available()]
+        # All breakers open: still try the provider that has been open the longest rather than drop the signal.
+        return healthy or sorted(self.providers, key=lambda p: p.breaker.opened_at)[:1]
+
+    async def _attempt(self, provider: Provider, prompt: str, track_latency: bool, on_delta=None, claim=None) -> str:
+        tokens = count_tokens(prompt) + AI_OUTPUT_TOKENS_ESTIMATE
+        for retry in range(AI_RATE_LIMIT_RETRIES + 1):
+            async with provider.scheduler.slot(tokens):
+                provider.breaker.on_attempt()
+                provider.requests += 1
+                start = time.monotonic()
+
+                def first_token() -> bool:
+                    # Streamed requests are timed to the first token; that is what hedging races on.
+                    if track_latency:
+                        provider.latency.record(time.monotonic() - start)
+                    return claim()
+
+                try:
+                    raw = await provider.client.chat.completions.with_raw_response.create(
+                        model=provider.model,
+                        messages=[{"role": "system", "content": prompt}],
+                        temperature=0.1,
+                        stream=on_delta is not None,
+                    )
+                    provider.scheduler.on_response(raw.headers)
+                    if on_delta is not None:
+                        return await self._read_stream(raw.parse(), on_delta, first_token)
+                    content = raw.parse().choices[0].message.content or ""
+                except asyncio.CancelledError:
+                    provider.breaker.on_cancel()
+                    raise
+                except RateLimitError as e:
+                    # Quota, not health: no breaker failure; wait for the pause and retry.
+                    provider.breaker.on_cancel()
+                    provider.scheduler.on_rate_limited(e.response.headers)
+                    if retry < AI_RATE_LIMIT_RETRIES:
+                        continue
+                    provider.errors += 1
+                    raise
+                except Exception as e:
+                    provider.errors += 1
+                    provider.breaker.on_failure()
+                    logger.warning(f"LLM provider {provider.name} failed: {e}")
+                    raise
+                if track_latency:
+                    provider.latency.record(time.monotonic() - start)
+                return content
+
+    @staticmethod
+    async def _read_stream(stream, on_delta, first_token) -> str:
+        parts = []
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if not parts and not first_token():
+                return ""  # another attempt is already streaming
+            parts.append(delta)
+            on_delta(delta)
+        return "".join(parts)
+
+    async def complete(self, prompt: str, timeout: float, validate=None, hedge: bool = True,
+                       on_delta=None) -> str:
+        """
+        Returns the first completion accepted by `validate` (any completion if None).
+        hedge=False disables the latency-triggered second request (failover on errors
+        still applies) and keeps the call out of the latency statistics, for large
+        requests such as batches whose latency is not comparable.
+        With on_delta the completion is streamed and on_delta(text) is called for each
+        piece. The first attempt to produce a token wins the race and the others are
+        cancelled at that point; `validate` is not applied, and once tokens have been
+        passed on there is no failover (it would repeat them).
+        Raises asyncio.TimeoutError when nothing arrived within `timeout`, or the last
+        provider error when every attempt failed. If answers arrived but none was valid,
+        the last non-empty one is returned.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        candidates = self._candidates()
+        max_attempts = max(2, len(candidates))
+        tasks: dict[asyncio.Task, Provider] = {}
+        attempts = 0
+        fallback = ""
+        last_error = None
+        owner = None  # streaming: the attempt whose tokens are passed on
+
+        def claim() -> bool:
+            nonlocal owner
+            task = asyncio.current_task()
+            if owner is None:
+                owner = task
+                for other in tasks:
+                    if other is not task:
+                        other.cancel()
+            return owner is task
+
+        def launch() -> asyncio.Task:
+            nonlocal attempts
+            provider = candidates[attempts % len(candidates)]
+            attempts += 1
+            task = asyncio.ensure_future(self._attempt(provider, prompt, hedge, on_delta, claim))
+            tasks[task] = provider
+            return task
+
+        primary = launch()
+        hedge_at = loop.time() + candidates[0].hedge_delay(timeout) if hedge else None
+        try:
+            while True:
+                now = loop.time()
+                if now >= deadline:
+                    raise asyncio.TimeoutError()
+                wait = deadline - now
+                if hedge_at is not None:
+                    wait = min(wait, max(0.0, hedge_at - now))
+                done, _ = await asyncio.wait(tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if hedge_at is not None and loop.time() >= hedge_at:
+                        hedge_at = None
+                        # A hedge only helps when it can start now; under saturation it would just queue.
+                        hedge_to = candidates[attempts % len(candidates)]
+                        if attempts < max_attempts and owner is None and hedge_to.scheduler.has_capacity():
+                            self.hedges += 1
+                            launch()
+                    continue
+                failed = 0
+                for task in done:
+                    provider = tasks.pop(task)
+                    if task.cancelled() or (owner is not None and task is not owner):
+                        continue  # lost the streaming race
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        failed += 1
+                        continue
+                    output = task.result()
+                    if validate is None or validate(output):
+                        provider.breaker.on_success()
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return output
+                    provider.breaker.on_failure()
+                    fallback = output or fallback
+                    failed += 1
+                # Every failed attempt is replaced by one on the next provider, even while others are in flight.
+                for _ in range(min(failed, max_attempts - attempts) if owner is None else 0):
+                    self.failovers += 1
+                    launch()
+                if not tasks:
+                    if fallback:
+                        return fallback
+                    raise last_error or asyncio.TimeoutError()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def model_id(self) -> str:
+        """
+        Identifies the models that may answer a request, for cache keys: the model name when
+        every provider runs the same model, else a hash of the (model, base_url) pairs.
+        """
+        models = sorted({(p.model, p.base_url) for p in self.providers})
+        if len({model for model, _ in models}) == 1:
+            return models[0][0]
+        digest = hashlib.sha256(json.dumps(models).encode("utf-8")).hexdigest()[:16]
+        return f"pool:{digest}"
+
+    def stats(self) -> dict:
+        return {
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "providers": {p.name: p.stats() for p in self.providers},
+        }
+
+
+def load_providers(default_base_url: str, default_model: str, default_key: str,
+                   max_concurrency: int) -> list[Provider]:
+    """
+    Providers from AI_PROVIDERS, or the single default provider when it is unset.
+    """
+    if not AI_PROVIDERS.strip():
+        return [Provider("default", default_base_url, default_model, default_key, max_concurrency)]
+    providers = []
+    for i, spec in enumerate(json.loads(AI_PROVIDERS)):
+        key = os.getenv(spec["api_key_env"]) if spec.get("api_key_env") else spec.get("api_key", default_key)
+        providers.append(Provider(
+            spec.get("name", f"provider{i}"),
+            spec.get("base_url", default_base_url),
+            spec.get("model", default_model),
+            key or default_key,
+            max_concurrency,
+            rpm=float(spec.get("rpm", AI_RPM)),
+            tpm=float(spec.get("tpm", AI_TPM)),
+        ))
+    return providers
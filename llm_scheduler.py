@@ -0,0 +1,249 @@
+# llm_scheduler.py
+"""
+Rate-limit-aware admission of LLM requests, one scheduler per provider.
+
+Providers limit requests and tokens per minute (RPM/TPM) per account, and the live
+worker and get_historical_signals.py share that quota. Every request waits here for
+
+  * a concurrency slot; the limit adapts AIMD-style (halved on HTTP 429, +1/limit
+    per success, at most AI_MAX_CONCURRENCY),
+  * one request from the RPM bucket and its estimated tokens from the TPM bucket,
+    both kept in sync with the provider's x-ratelimit-remaining-* headers,
+  * the end of any pause ordered by retry-after / x-ratelimit-reset-* after a 429.
+
+Waiters are served strictly by priority: a waiting live request is always admitted
+before any backfill request. Backfill may in addition only use AI_BACKFILL_SHARE of
+the concurrency limit and of each bucket, so a live signal arriving during a replay
+finds capacity immediately instead of queueing behind in-flight backfill.
+
+The priority of a request comes from the llm_priority context variable (PRIORITY_LIVE
+by default); get_historical_signals.py switches it to PRIORITY_BACKFILL.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger("signalworker.llm_scheduler")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # optional dependency (or its encoding file is not available offline)
+    _encoding = None
+
+PRIORITY_LIVE = 0
+PRIORITY_BACKFILL = 1
+llm_priority = contextvars.ContextVar("llm_priority", default=PRIORITY_LIVE)
+
+# Per-minute budgets of a provider (0 = unlimited); AI_PROVIDERS entries may override them with "rpm"/"tpm".
+AI_RPM = float(os.getenv("AI_RPM", "0"))
+AI_TPM = float(os.getenv("AI_TPM", "0"))
+AI_BACKFILL_SHARE = float(os.getenv("AI_BACKFILL_SHARE", "0.75"))
+# Expected completion tokens of one request, added to the prompt estimate for the TPM budget.
+AI_OUTPUT_TOKENS_ESTIMATE = 200
+# Pause after a 429 without retry-after/reset headers.
+AI_RATE_LIMIT_PAUSE = 1.0
+
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)?")
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for the mostly ASCII prompts we send
+    return len(text) // 4 + 1
+
+
+def count_tokens(text: str) -> int:
+    """
+    Token count with tiktoken's cl100k_base when installed (close to the Llama/GPT
+    tokenizers for this text), else estimate_tokens().
+    """
+    if _encoding is None:
+        return estimate_tokens(text)
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def parse_duration(value: str | None) -> float | None:
+    """
+    Seconds from header values like "1", "7.66s", "2m59.56s" or "6ms".
+    """
+    if not value:
+        return None
+    total, matched = 0.0, False
+    for number, unit in DURATION_RE.findall(value.strip()):
+        matched = True
+        total += float(number) * {"ms": 0.001, "h": 3600, "m": 60}.get(unit, 1)
+    return total if matched else None
+
+
+class TokenBucket:
+    """
+    Refills continuously at per_minute / 60 per second up to per_minute.
+    A bucket with per_minute <= 0 never limits.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    def wait_time(self, amount: float, reserve: float = 0.0) -> float:
+        """
+        Seconds until `amount` can be taken while leaving `reserve` (fraction of capacity) untouched.
+        """
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        needed = min(amount, self.capacity) + reserve * self.capacity - self.level
+        return max(0.0, needed * 60 / self.capacity)
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+
+    def sync(self, remaining: float):
+        if not self.unlimited:
+            self._refill()
+            self.level = min(self.level, remaining)
+
+
+class RateLimitScheduler:
+    def __init__(self, name: str, max_concurrency: int, rpm: float = AI_RPM, tpm: float = AI_TPM):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._waiters = []  # heap of (priority, seq, tokens, future)
+        self._seq = itertools.count()
+        self._timer = None
+        self.admitted = {PRIORITY_LIVE: 0, PRIORITY_BACKFILL: 0}
+        self.queue_time = {PRIORITY_LIVE: 0.0, PRIORITY_BACKFILL: 0.0}
+        self.rate_limited = 0
+
+    @asynccontextmanager
+    async def slot(self, tokens: int, priority: int | None = None):
+        priority = llm_priority.get() if priority is None else priority
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # admitted, but cancelled before it could run
+            raise
+        self.admitted[priority] = self.admitted.get(priority, 0) + 1
+        self.queue_time[priority] = self.queue_time.get(priority, 0.0) + time.monotonic() - start
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._waiters:
+            priority, _, tokens, future = self._waiters[0]
+            if future.done():  # cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            reserve = 0.0 if priority == PRIORITY_LIVE else 1 - AI_BACKFILL_SHARE
+            if self.in_flight >= max(1, int(self.limit * (1 - reserve))):
+                return  # woken again by _release
+            wait = max(
+                self.paused_until - time.monotonic(),
+                self.requests.wait_time(1, reserve),
+                self.tokens.wait_time(tokens, reserve),
+            )
+            if wait > 0:
+                self._wake_in(wait)
+                return
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _wake_in(self, seconds: float):
+        loop = asyncio.get_running_loop()
+        when = loop.time() + seconds
+        if self._timer is not None:
+            if self._timer.when() <= when:
+                return
+            self._timer.cancel()
+        self._timer = loop.call_at(when, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def has_capacity(self) -> bool:
+        """
+        True if a live request would be admitted right away (nobody waiting, a slot free).
+        """
+        return self.in_flight < int(self.limit) and not any(not f.done() for *_, f in self._waiters)
+
+    def on_response(self, headers):
+        """
+        Successful call: additive increase and bucket sync from the rate-limit headers.
+        """
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        self._sync(headers)
+
+    def on_rate_limited(self, headers) -> float:
+        """
+        HTTP 429: multiplicative decrease and a pause. Returns the pause in seconds.
+        """
+        self.rate_limited += 1
+        self.limit = max(1.0, self.limit / 2)
+        self._sync(headers)
+        pause = (parse_duration(headers.get("retry-after"))
+                 or max(parse_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+                        parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0)
+                 or AI_RATE_LIMIT_PAUSE)
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        logger.warning(f"{self.name}: rate limited, pausing {pause:.2f}s, concurrency limit {self.limit:.1f}")
+        return pause
+
+    def _sync(self, headers):
+        if headers is None:
+            return
+        for bucket, header in ((self.requests, "x-ratelimit-remaining-requests"),
+                               (self.tokens, "x-ratelimit-remaining-tokens")):
+            try:
+                bucket.sync(float(headers.get(header)))
+            except (TypeError, ValueError):
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": sum(1 for *_, f in self._waiters if not f.done()),
+            "live": self.admitted[PRIORITY_LIVE],
+            "backfill": self.admitted[PRIORITY_BACKFILL],
+            "live_queue_s": round(self.queue_time[PRIORITY_LIVE], 3),
+            "backfill_queue_s": round(self.queue_time[PRIORITY_BACKFILL], 3),
+            "rate_limited": self.rate_limited,
+        }
@@ -0,0 +1,235 @@
+# llm_stub.py
+"""
+Local OpenAI-compatible chat completions server for benchmarks.
+
+Answers POST .../chat/completions with a canned message and counts requests that are
+in flight, so benchmarks can see abandoned requests.
+
+  * Latency: `latency` is the median; with latency_sigma > 0 each request draws from a
+    lognormal distribution around it (sigma 0.5 gives a p99 of ~3.2x the median).
+  * Errors: error_rate is the fraction of requests answered with HTTP 500.
+  * Content: add_response(match, content) / load_recordings(path) register answers for
+    prompts containing `match` (the longest match wins); other prompts get `content`.
+    Recordings are JSONL lines {"match": ..., "content": ...}, e.g. written by
+    bench_corpus.py --record from a real provider.
+With rpm > 0 it enforces a requests-per-minute limit like Groq/OpenAI: every answer
+carries x-ratelimit-remaining-requests / x-ratelimit-reset-requests, and requests
+over the limit get HTTP 429 with retry-after.
+Requests with "stream": true get the content as server-sent events: the first chunk
+after `latency`, then one small chunk every `chunk_interval` seconds.
+
+Usage: python llm_stub.py [port] [latency_seconds] [recordings.jsonl]
+"""
+import json
+import math
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESPONSE = json.dumps({
+    "instrument": "XAUUSD",
+    "signal": "BUY LIMIT",
+    "entries": [1930, 1932],
+    "sl": 1920,
+    "tps": ["30 pips", "50 pips", "80 pips", "Open"],
+}, indent=2)
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency: float = 0.2, content: str = DEFAULT_RESPONSE,
+                 rpm: float = 0, chunk_interval: float = 0.01, chunk_size: int = 8,
+                 latency_sigma: float = 0.0, error_rate: float = 0.0, seed: int | None = None):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.content = content
+        self.responses: dict[str, str] = {}
+        self._random = random.Random(seed)
+        self.errors = 0
+        self.chunk_interval = chunk_interval
+        self.chunk_size = chunk_size
+        self.rpm = rpm
+        self._allowance = rpm
+        self._allowance_at = time.monotonic()
+        self.rate_limited = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def take_request(self) -> tuple[bool, dict]:
+        """
+        Token bucket over rpm; returns (allowed, rate-limit headers).
+        """
+        if self.rpm <= 0:
+            return True, {}
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rpm, self._allowance + (now - self._allowance_at) * self.rpm / 60)
+            self._allowance_at = now
+            allowed = self._allowance >= 1
+            if allowed:
+                self._allowance -= 1
+            else:
+                self.rate_limited += 1
+            reset = (1 - self._allowance) * 60 / self.rpm if self._allowance < 1 else 0.0
+            headers = {
+                "x-ratelimit-limit-requests": str(int(self.rpm)),
+                "x-ratelimit-remaining-requests": str(int(self._allowance)),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+            }
+        if not allowed:
+            headers["retry-after"] = f"{reset:.3f}"
+        return allowed, headers
+
+    def add_response(self, match: str, content: str):
+        self.responses[match] = content
+
+    def load_recordings(self, path: str) -> int:
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        for record in records:
+            self.add_response(record["match"], record["content"])
+        return len(records)
+
+    def response_for(self, prompt: str) -> str:
+        matches = [m for m in self.responses if m in prompt]
+        return self.responses[max(matches, key=len)] if matches else self.content
+
+    def draw_latency(self) -> float:
+        with self._lock:
+            if self.latency_sigma <= 0 or self.latency <= 0:
+                return self.latency
+            return self._random.lognormvariate(math.log(self.latency), self.latency_sigma)
+
+    def draw_error(self) -> bool:
+        with self._lock:
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            self.errors += failed
+            return failed
+
+    def start(self) -> "StubLLMServer":
+        threading.Thread(target=self.serve_forever, name="llm-stub", daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server: StubLLMServer = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        allowed, headers = server.take_request()
+        if not allowed:
+            self._send(429, {"error": {"message": "rate limit exceeded", "type": "rate_limit_exceeded"}}, headers)
+            return
+        with server._lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.draw_latency())
+            if server.draw_error():
+                self._send(500, {"error": {"message": "stub: injected server error", "type": "server_error"}})
+                return
+            prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+            content = server.response_for(prompt)
+            if body.get("stream"):
+                self._stream(body.get("model", "stub"), content, server, headers)
+            else:
+                self._send(200, completion(body.get("model", "stub"), content), headers)
+        finally:
+            with server._lock:
+                server.in_flight -= 1
+
+    def _send(self, status: int, payload: dict, headers: dict | None = None):
+        data = json.dumps(payload).encode("utf-8")
+        try:
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client gave up (timeout/cancellation)
+
+
+    def _stream(self, model: str, content: str, server: StubLLMServer, headers: dict):
+        try:
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(content), server.chunk_size):
+                if i:
+                    time.sleep(server.chunk_interval)
+                self._write_event(json.dumps(completion_chunk(model, content[i:i + server.chunk_size])))
+            self._write_event(json.dumps(completion_chunk(model, None, finish_reason="stop")))
+            self._write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client gave up (timeout/cancellation/lost hedge)
+
+    def _write_event(self, data: str):
+        payload = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+        self.wfile.flush()
+
+
+def completion_chunk(model: str, content: str | None, finish_reason: str | None = None) -> dict:
+    return {
+        "id": "chatcmpl-stub-stream",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "delta": {"content": content} if content is not None else {},
+            "finish_reason": finish_reason,
+        }],
+    }
+
+
+def completion(model: str, content: str) -> dict:
+    return {
+        "id": f"chatcmpl-stub-{time.monotonic_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8089
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    server = StubLLMServer(("127.0.0.1", port), latency=latency)
+    if len(sys.argv) > 3:
+        print(f"Loaded {server.load_recordings(sys.argv[3])} recorded responses")
+    print(f"LLM stub listening on {server.base_url} (latency {latency}s)")
+    server.serve_forever()
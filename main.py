@@ -1,5 +1,8 @@
 import asyncio
+import contextlib
+import json
 import os
+import signal
 import sys
 import traceback
 from dotenv import load_dotenv
@@ -11,6 +14,11 @@ from telethon.sessions import StringSession
 from handlers import register_handlers
 from config import SOURCE_CHANNEL_IDS
 from signal_db import init_db
+import signal_db_async
+from signal_processor import start_signal_expiry
+from filters import start_filter_reload, filter_stats
+from sanitizer import fast_path_stats, compaction_stats, sanitizer_cache, provider_pool
+from dropbox_writer import upload_latency
 from fastapi.responses import HTMLResponse
 from fastapi import FastAPI, Request, Form
 init_db()
@@ -20,6 +28,8 @@ API_ID = int(os.getenv("TELEGRAM_API_ID"))
 API_HASH = os.getenv("TELEGRAM_API_HASH")
 SESSION_STRING = os.getenv("TELEGRAM_STRING_SESSION")
 PHONE = os.getenv("TELEGRAM_PHONE")  # store your phone number here
+# Alle n Sekunden eine Zeile mit den Pipeline-Statistiken ausgeben (0 = aus)
+STATS_LOG_INTERVAL = float(os.getenv("STATS_LOG_INTERVAL", "900"))
 
 app = FastAPI()
 pending_clients = {}   # store temporary TelegramClients awaiting login
@@ -99,6 +109,38 @@ async def login_verify_form(code: str = Form(...), password: str = Form(None)):
     </button>
     <p>Bitte kopiere diesen String in deine Umgebungsvariablen (TELEGRAM_STRING_SESSION) auf Railway.</p>
     """
+# ---------- pipeline statistics ----------
+
+def pipeline_stats() -> dict:
+    return {
+        "filter": filter_stats.report(),
+        "fast_path": fast_path_stats.report(),
+        "compaction": compaction_stats.report(),
+        "llm_cache": sanitizer_cache.stats(),
+        "llm_providers": provider_pool.stats(),
+        "dropbox_upload": upload_latency.report(),
+    }
+
+
+def print_stats():
+    print(f"📊 Pipeline stats: {json.dumps(pipeline_stats(), ensure_ascii=False, default=str)}")
+
+
+async def _stats_log_loop(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        print_stats()
+
+
+def start_stats_log() -> asyncio.Task | None:
+    """
+    Prints pipeline_stats() every STATS_LOG_INTERVAL seconds on the running event loop.
+    """
+    if STATS_LOG_INTERVAL <= 0:
+        return None
+    return asyncio.create_task(_stats_log_loop(STATS_LOG_INTERVAL), name="stats-log")
+
+
 # ---------- main bot runtime ----------
 
 async def main():
@@ -114,6 +156,32 @@ async def main():
         await server.serve()
         return
 
+    # Invalidates pending signals on their deadline (heap-ordered, runs on this event loop)
+    expiry_task = start_signal_expiry()
+    # Übernimmt neue Versionen der Filter-Regeldatei im Hintergrund
+    filter_reload_task = start_filter_reload()
+    # Filter-, Fast-Path-, Kompressions-, Cache-, Provider- und Upload-Statistiken ins Log
+    stats_task = start_stats_log()
+
+    # SIGTERM (Redeploy) und SIGINT beenden die Laufschleife; atexit läuft bei SIGTERM nicht,
+    # daher wird das Write-Behind-Journal unten im finally geschrieben.
+    main_task = asyncio.current_task()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):  # Windows
+            asyncio.get_running_loop().add_signal_handler(sig, main_task.cancel)
+
+    try:
+        await run_client()
+    except asyncio.CancelledError:
+        print("🛑 Shutdown signal received.")
+    finally:
+        print_stats()
+        written = await signal_db_async.flush()
+        await signal_db_async.close()
+        print(f"✅ Signal DB flushed ({written} queued entries written) and closed.")
+
+
+async def run_client():
     while True:
         try:
             client = get_client()
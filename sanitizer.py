@@ -5,8 +5,15 @@ import re
 import uuid
 import logging
 import os
-from openai import OpenAI
+import time
+import hashlib
+import unicodedata
 from dotenv import load_dotenv
+from llm_cache import SanitizerCache, LLM_CACHE_ENABLED, make_key as make_cache_key
+from llm_providers import ProviderPool, load_providers
+from llm_scheduler import PRIORITY_BACKFILL, llm_priority, estimate_tokens, count_tokens
+from json_stream import JsonObjectStream, iter_objects as iter_json_objects
+from utils import split_signals
 
 # Load .env variables
 load_dotenv()
@@ -22,11 +29,16 @@ if not logger.hasHandlers():
 AI_MODEL = os.getenv("AI_MODEL", "llama-3.3-70b-versatile")
 AI_BASE_URL = os.getenv("AI_BASE_URL", "https://api.groq.com/openai/v1")
 AI_KEY = os.getenv("AI_KEY", os.getenv("GROQ_API_KEY") or os.getenv("OPENAI_API_KEY"))
+# Max. LLM requests in flight at once (further calls queue, still within their timeout)
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
 instrument = "XAUUSD"
 if not AI_KEY:
     raise RuntimeError("❌ Missing AI_KEY (set GROQ_API_KEY or OPENAI_API_KEY in .env)")
 
-client = OpenAI(api_key=AI_KEY, base_url=AI_BASE_URL)
+# Shared async clients (one per provider, see llm_providers.py) with hedging and failover.
+provider_pool = ProviderPool(load_providers(AI_BASE_URL, AI_MODEL, AI_KEY, AI_MAX_CONCURRENCY))
+# Cache-Schlüssel: Modell(e) des Pools, nicht AI_MODEL (AI_PROVIDERS kann andere Modelle routen)
+CACHE_MODEL_ID = provider_pool.model_id()
 # sanitizer.py (DIESER BLOCK ERSETZT IHRE VORHANDENE SANITIZE_SIGNAL FUNKTION)
 
 from typing import List, Dict, Any  # <-- Sicherstellen, dass dies ganz oben importiert ist
@@ -145,19 +157,50 @@ Only output valid JSON with these fields, no explanations or extra text.
 
 {text}
 """
+# Part of the sanitizer cache key: editing the prompt invalidates cached results.
+PROMPT_VERSION = hashlib.sha256(ai_prompt.encode("utf-8")).hexdigest()[:12]
+sanitizer_cache = SanitizerCache()
 
-async def sanitize_with_ai(signal_text: str, timeout: int = 10) -> str:
+async def sanitize_with_ai(signal_text: str, timeout: int = 10, on_idea=None) -> str:
+    """
+    Returns the LLM answer for one message. With on_idea the answer is streamed and
+    on_idea(idea) is called for every idea object as soon as its closing brace arrives.
+    """
     prompt = ai_prompt.format(text=signal_text)
+    if on_idea is None:
+        return await complete_prompt(prompt, timeout=timeout, validate=is_json_output)
+
+    decoder = JsonObjectStream()
+
+    def on_delta(delta: str):
+        for obj in decoder.feed(delta):
+            if is_idea(obj):
+                on_idea(obj)
+
+    return await complete_prompt(prompt, timeout=timeout, on_delta=on_delta)
+
+
+def is_json_output(ai_output: str) -> bool:
+    """
+    True if the completion contains JSON (a hedged request is only accepted if it does).
+    """
+    cleaned = clean_llm_output(ai_output)
+    if not cleaned:
+        return False
     try:
-        def blocking_call():
-            return client.chat.completions.create(
-                model=AI_MODEL,
-                messages=[{"role": "system", "content": prompt}],
-                temperature=0.1,
-            )
-        response = await asyncio.wait_for(asyncio.to_thread(blocking_call), timeout=timeout)
-        # Extract message content from response before returning
-        return response.choices[0].message.content
+        json.loads(cleaned)
+        return True
+    except json.JSONDecodeError:
+        return bool(iter_json_objects(cleaned))
+
+
+async def complete_prompt(prompt: str, timeout: int = 10, validate=None, hedge: bool = True, on_delta=None) -> str:
+    """
+    Sends one system prompt to the LLM and returns the completion text ("" on timeout/error).
+    """
+    try:
+        # Cancelled requests (timeout, losing hedge) abort their HTTP call and free their slot.
+        return await provider_pool.complete(prompt, timeout=timeout, validate=validate, hedge=hedge, on_delta=on_delta)
     except asyncio.TimeoutError:
         logger.error("⏱️ AI sanitization timed out.")
         return ""
@@ -177,7 +220,12 @@ async def sanitize_with_ai(signal_text: str, timeout: int = 10) -> str:
 
 # Main async sanitizer function
 async def sanitize_signal(signal_text: str, is_reply: bool = False, timeout: int = 10, main_signalid: str = None,
-                          link: str = None, source: str = None) -> dict:
+                          link: str = None, source: str = None, on_signals=None) -> dict:
+    """
+    Returns {"signals": [...]}. If the async callback on_signals is given, every signal is
+    also passed to it, for LLM answers idea by idea while the answer is still streaming,
+    so the first signals can be processed before the model has finished.
+    """
     print(is_reply, "is_reply", main_signalid, "main_signalid")
 
     # ----------------------------------------
@@ -197,6 +245,8 @@ async def sanitize_signal(signal_text: str, is_reply: bool = False, timeout: int
         if manipulation_result:
             if link:
                 manipulation_result["link"] = link
+            if on_signals:
+                await on_signals([manipulation_result])
             return {"signals": [manipulation_result]}
 
         return {"signals": []}
@@ -205,39 +255,167 @@ async def sanitize_signal(signal_text: str, is_reply: bool = False, timeout: int
     # 2. HANDLE NEUES SIGNAL (AI Parsing)
     # ----------------------------------------
 
+    # NEU: Posts mit mehreren unabhängigen Signalblöcken werden blockweise parallel verarbeitet
+    blocks = split_signal_blocks(signal_text) if SPLIT_SIGNAL_BLOCKS else [signal_text]
+    if len(blocks) > 1:
+        return await _sanitize_blocks(blocks, timeout, link, source, on_signals)
+    return await _sanitize_new_signal(signal_text, timeout, link, source, on_signals)
+
+
+async def _sanitize_new_signal(signal_text: str, timeout: int, link: str, source: str, on_signals) -> dict:
+    # NEU: Deterministischer Fast-Path für bekannte Layouts (Mikrosekunden statt LLM-Aufruf)
+    local_ideas, confidence, local_latency = [], 0.0, 0.0
+    if FAST_PATH_MODE in ("on", "shadow"):
+        started = time.perf_counter()
+        local_ideas, confidence = parse_signal_locally(signal_text)
+        local_latency = time.perf_counter() - started
+        if FAST_PATH_MODE == "on" and confidence >= FAST_PATH_MIN_CONFIDENCE:
+            fast_path_stats.record_fast_path(source, local_latency)
+            signals = ideas_to_signals(local_ideas, source=source, link=link)
+            if on_signals and signals:
+                await on_signals(signals)
+            return {"signals": signals}
+
+    started = time.perf_counter()
+    if on_signals:
+        extracted_ideas, streamed_signals = await _stream_signals(signal_text, timeout, on_signals, source, link)
+    else:
+        extracted_ideas, streamed_signals = await _ideas_from_llm(signal_text, timeout, source=source), None
+    llm_latency = time.perf_counter() - started
+
+    if FAST_PATH_MODE == "shadow":
+        fast_path_stats.record_shadow(source, local_ideas, confidence, extracted_ideas, local_latency, llm_latency)
+    elif FAST_PATH_MODE == "on":
+        fast_path_stats.record_fallback(source, llm_latency)
+
+    if streamed_signals is not None:
+        # Bereits Idee für Idee über on_signals ausgeliefert
+        return {"signals": streamed_signals}
+
+    if not extracted_ideas:
+        return {"signals": []}
+
+    # ----------------------------------------
+    # 3. CONVERT IDEAS TO ATOMIC SIGNALS
+    # ----------------------------------------
+
+    return {"signals": ideas_to_signals(extracted_ideas, source=source, link=link)}
+
+
+async def _sanitize_blocks(blocks: List[str], timeout: int, link: str, source: str, on_signals) -> dict:
+    """
+    Sanitizes the blocks of a multi-signal post concurrently (the provider pool bounds the
+    LLM calls) and merges their signals in block order. on_signals receives block k's
+    signals once blocks 0..k-1 are finished, so the delivery order is the post order.
+    """
+    logger.info(f"Splitting message from {source} into {len(blocks)} signal blocks.")
+    pending = [[] for _ in blocks]      # signals of each block not yet delivered
+    finished = [False] * len(blocks)
+    next_block = 0
+    relay = asyncio.Lock()
+
+    async def deliver():
+        nonlocal next_block
+        async with relay:
+            while next_block < len(blocks):
+                while pending[next_block]:
+                    await on_signals(pending[next_block].pop(0))
+                if not finished[next_block]:
+                    return
+                next_block += 1
+
+    async def run(index: int, block: str) -> dict:
+        async def collect(signals):
+            pending[index].append(signals)
+            await deliver()
+
+        try:
+            return await _sanitize_new_signal(block, timeout, link, source, collect if on_signals else None)
+        finally:
+            finished[index] = True
+            if on_signals:
+                await deliver()
+
+    results = await asyncio.gather(*(run(i, block) for i, block in enumerate(blocks)))
+    return {"signals": [signal for result in results for signal in result["signals"]]}
+
+
+async def _stream_signals(signal_text: str, timeout: int, on_signals, source: str, link: str):
+    """
+    Runs _ideas_from_llm in the background and converts and delivers each idea as it
+    arrives. Returns (ideas, delivered signals).
+    """
+    ideas = asyncio.Queue()
+    llm = asyncio.create_task(_ideas_from_llm(signal_text, timeout, on_idea=ideas.put_nowait, source=source))
+    llm.add_done_callback(lambda _: ideas.put_nowait(None))
+    delivered = []
+    try:
+        while (idea := await ideas.get()) is not None:
+            signals = ideas_to_signals([idea], source=source, link=link)
+            if signals:
+                await on_signals(signals)
+                delivered.extend(signals)
+    finally:
+        if not llm.done():
+            llm.cancel()
+    return await llm, delivered
+
+
+async def _ideas_from_llm(signal_text: str, timeout: int, on_idea=None, source: str = None) -> List[Dict[str, Any]]:
+    """
+    Ideas for one message from the primed map, the cache or the LLM. on_idea(idea) is
+    called for each idea: as it streams in for LLM answers, else right before returning.
+    """
+    # NEU: Nur die handelsrelevanten Zeilen gehen ans LLM (und in den Cache-Schlüssel)
+    llm_text = _llm_text(signal_text)
+    # NEU: Zuerst im persistenten Cache nachsehen (gleicher Text, gleicher Prompt, gleiches Modell)
+    cache_key = make_cache_key(llm_text, PROMPT_VERSION, CACHE_MODEL_ID)
+    if cache_key in _primed_ideas:
+        # Bereits per sanitize_batch (Historien-Replay) extrahiert
+        extracted_ideas = _primed_ideas.pop(cache_key)
+    else:
+        extracted_ideas = await asyncio.to_thread(sanitizer_cache.get, cache_key) if LLM_CACHE_ENABLED else None
+        if extracted_ideas is not None:
+            logger.info(f"Sanitizer cache hit ({sanitizer_cache.stats()}).")
+
+    if extracted_ideas is not None:
+        for idea in extracted_ideas if on_idea else ():
+            on_idea(idea)
+        return extracted_ideas
+
     # NEU: KI aufrufen (sanitize_with_ai MUSS VORHER DEFINIERT SEIN)
-    ai_output = await sanitize_with_ai(signal_text, timeout=timeout)
+    prompt_tokens = compaction_stats.record(source, signal_text, llm_text)
+    logger.debug(f"LLM request for {source}: ~{prompt_tokens} prompt tokens.")
+    started = time.perf_counter()
+    ai_output = await sanitize_with_ai(llm_text, timeout=timeout, on_idea=on_idea)
     if not ai_output:
         logger.warning("AI did not return any output.")
-        return {"signals": []}
+        return []
 
-    # NEU: Robustes Multi-JSON-Parsing (definiert 'json_objects' und 'extracted_ideas')
-    extracted_ideas: List[Dict[str, Any]] = []
+    extracted_ideas = parse_ai_ideas(ai_output)
+    if extracted_ideas and LLM_CACHE_ENABLED:
+        await asyncio.to_thread(sanitizer_cache.put, cache_key, extracted_ideas, time.perf_counter() - started)
+    return extracted_ideas
 
-    raw_json_text = ai_output.replace("```json", "").replace("```", "").strip()
-    json_objects = re.findall(r'\{[^}]*\}', raw_json_text)
 
-    if not json_objects:
+def parse_ai_ideas(ai_output: str) -> List[Dict[str, Any]]:
+    # Alle JSON-Objekte (auch verschachtelte, in Arrays oder Code-Fences) mit "instrument" sind Ideen
+    if not ai_output or "{" not in ai_output:
         logger.warning(f"⚠️ AI output is not valid JSON (no complete objects found): {ai_output}")
-        return {"signals": []}
+        return []
 
-    for json_str in json_objects:
-        try:
-            obj = json.loads(json_str.strip())
-            if isinstance(obj, dict) and obj.get("instrument"):
-                extracted_ideas.append(obj)
-        except json.JSONDecodeError as e:
-            logger.warning(f"⚠️ Failed to parse sub-JSON object: {e}. Object: {json_str[:50]}...")
-            continue
+    extracted_ideas = [obj for obj in iter_json_objects(ai_output) if is_idea(obj)]
 
     if not extracted_ideas:
         logger.warning("⚠️ No valid signal ideas extracted after robust parsing.")
-        return {"signals": []}
+    return extracted_ideas
+
+
+def is_idea(obj) -> bool:
+    return isinstance(obj, dict) and bool(obj.get("instrument"))
 
-    # ----------------------------------------
-    # 3. CONVERT IDEAS TO ATOMIC SIGNALS
-    # ----------------------------------------
 
+def ideas_to_signals(extracted_ideas: List[Dict[str, Any]], source: str = None, link: str = None) -> List[Dict[str, Any]]:
     final_signals: List[Dict[str, Any]] = []
 
     for idea in extracted_ideas:
@@ -267,7 +445,501 @@ async def sanitize_signal(signal_text: str, is_reply: bool = False, timeout: int
             logger.error(f"Error processing idea with create_signals: {e}, Idea: {idea}")
             continue
 
-    return {"signals": final_signals}
+    return final_signals
+# ----------------------------------------
+# LOCAL FAST-PATH PARSER
+# ----------------------------------------
+# Most channels post in a few fixed layouts, e.g.
+#   XAUUSD BUY LIMIT / Entry: 1930 - 1932 / SL: 1920 / TP: 30 pips – 50 pips – Open
+# parse_signal_locally() reads those into the same idea dict the LLM returns and rates how
+# sure it is; anything unusual (several ideas, unlabelled numbers, SL on the wrong side)
+# lowers the confidence so the message goes to the LLM instead.
+
+# off: LLM only | shadow: LLM result is used, local parse is compared | on: local parse when confident
+# Default shadow until fast_path_stats shows the agreement rate per channel (see FastPathStats).
+FAST_PATH_MODE = os.getenv("SANITIZER_FAST_PATH", "shadow").lower()
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("SANITIZER_FAST_PATH_MIN_CONFIDENCE", "0.9"))
+# SL/TP further than this fraction of the entry away is implausible (a lot size, RR or count read as a price)
+FAST_PATH_MAX_DISTANCE = float(os.getenv("SANITIZER_FAST_PATH_MAX_DISTANCE", "0.1"))
+
+INSTRUMENT_ALIASES = [
+    (re.compile(r'\b(?:XAU\s*/?\s*USD|GOLD)\b', re.IGNORECASE), "XAUUSD"),
+    (re.compile(r'\b(?:XAG\s*/?\s*USD|SILVER)\b', re.IGNORECASE), "XAGUSD"),
+    (re.compile(r'\b(?:BTC\s*/?\s*USDT?|BITCOIN)\b', re.IGNORECASE), "BTCUSD"),
+    (re.compile(r'\b(?:US\s*30|DJ\s*30|DOW\s*JONES|DOW)\b', re.IGNORECASE), "US30"),
+    (re.compile(r'\b(?:US\s*100|NAS\s*100|NASDAQ)\b', re.IGNORECASE), "US100"),
+]
+FX_PAIR_RE = re.compile(r'\b((?:EUR|GBP|AUD|NZD|USD|CAD|CHF|JPY){2})\b', re.IGNORECASE)
+DIRECTION_RE = re.compile(r'\b(BUY|SELL|LONG|SHORT)\b(?:\s+(LIMIT|STOP))?', re.IGNORECASE)
+# Labels that start an SL or TP segment; a line may hold several ("BUY 2400 SL 2390 TP 2410").
+LABEL_RE = re.compile(
+    r'(?P<sl>\bSL\b|\bstop\s*loss\b|🟣)'
+    r'|(?P<tp>\bTP\d?\b|\btake\s*profit(?:\s*\d(?=\s*:))?|\btarget(?:\s*\d(?=\s*:))?|🟡)',
+    re.IGNORECASE,
+)
+ENTRY_LABEL_RE = re.compile(r'\b(?:entry|entries|enter|zone|price|now)\b|@', re.IGNORECASE)
+NUMBER_RE = re.compile(r'(?<![\w.])\d+(?:\.\d+)?(?![\w.])')
+# "TP1 2390 (100 pips)": the bracket after a price is a note on its distance, not another TP
+TP_NOTE_RE = re.compile(r'(?<=\d)\s*\([^)]*\)')
+# Values in an SL/TP segment, separated by whitespace or punctuation ("2390 2380", "30 pips – Open").
+# A word ends the list; a number right before it belongs to it ("2 trades", "lot 0.01").
+SEGMENT_TOKEN_RE = re.compile(
+    r'(?P<word>(?<![\w.])(?:\d+(?:\.\d+)?\s+)?(?!(?:pips?|points?|open)\b)[^\W\d_]+)'
+    r'|(?<![\w.])(?P<number>\d+(?:\.\d+)?)(?:\s*(?P<unit>pips?|points?)\b)?(?![\w.])'
+    r'|\b(?P<open>open)\b'
+    r'|(?P<other>\d\S*)',
+    re.IGNORECASE,
+)
+
+
+def _number(token: str):
+    value = float(token)
+    return int(value) if value.is_integer() and "." not in token else value
+
+
+def _find_instrument(text: str) -> tuple[str | None, str]:
+    """Returns (standardized instrument, text with the instrument token removed)."""
+    for pattern, symbol in INSTRUMENT_ALIASES:
+        match = pattern.search(text)
+        if match:
+            return symbol, text[:match.start()] + " " + text[match.end():]
+    match = FX_PAIR_RE.search(text)
+    if match:
+        return match.group(1).upper(), text[:match.start()] + " " + text[match.end():]
+    return None, text
+
+
+def _segment_values(segment: str) -> tuple[list, bool]:
+    """
+    Values (number, unit, is_open) at the start of an SL/TP segment and whether anything
+    else follows them (words, more numbers), which the caller counts as unexplained.
+    """
+    values = []
+    for match in SEGMENT_TOKEN_RE.finditer(TP_NOTE_RE.sub(" ", segment)):
+        if match.group("word") or match.group("other"):
+            return values, True
+        values.append((match.group("number"), (match.group("unit") or "").lower(), bool(match.group("open"))))
+    return values, False
+
+
+def parse_signal_locally(text: str) -> tuple[List[Dict[str, Any]], float]:
+    """
+    Template parser for single-idea signals. Returns ([idea], confidence) with the idea in
+    the LLM's format (instrument, signal, entries, sl, tps) or ([], 0.0) if it cannot tell.
+    """
+    instrument_, rest = _find_instrument(text)
+    directions = DIRECTION_RE.findall(rest)
+    if not instrument_ or not directions:
+        return [], 0.0
+    if len({d[0].upper().replace("LONG", "BUY").replace("SHORT", "SELL") for d in directions}) > 1 or len(directions) > 2:
+        return [], 0.0  # several ideas or a recap - leave it to the LLM
+
+    side, order_type = directions[0]
+    side = {"LONG": "BUY", "SHORT": "SELL"}.get(side.upper(), side.upper())
+    signal_type = f"{side} {(order_type or 'LIMIT').upper()}"
+
+    entries, sl, tps, unexplained = [], None, [], 0
+    for line in rest.splitlines():
+        labels = list(LABEL_RE.finditer(line))
+        prefix = line[:labels[0].start()] if labels else line
+        numbers = NUMBER_RE.findall(prefix)
+        if numbers:
+            if not entries and (DIRECTION_RE.search(prefix) or ENTRY_LABEL_RE.search(prefix)):
+                entries = [_number(n) for n in numbers]
+            else:
+                unexplained += 1
+        for i, label in enumerate(labels):
+            segment = line[label.end():labels[i + 1].start() if i + 1 < len(labels) else len(line)]
+            values, trailing = _segment_values(segment)
+            unexplained += trailing
+            if label.group("sl"):
+                if not values:
+                    continue
+                number, unit, is_open = values[0]
+                if sl is None and number and not unit:
+                    sl = _number(number)
+                else:
+                    unexplained += 1  # second SL, "SL: 20 pips" or "SL open" - leave it to the LLM
+                unexplained += len(values) > 1
+                continue
+            for number, unit, is_open in values:
+                if is_open:
+                    tps.append("Open")
+                elif unit.startswith("point"):
+                    unexplained += 1  # points vs. pips differ per broker/instrument - leave it to the LLM
+                elif unit:
+                    tps.append(f"{number} pips")
+                else:
+                    tps.append(_number(number))
+
+    if not entries:
+        return [], 0.0
+
+    idea = {"instrument": instrument_, "signal": signal_type, "entries": entries, "sl": sl, "tps": tps}
+    confidence = 0.6 + (0.2 if sl is not None else 0.0) + (0.2 if tps else 0.0)
+    confidence -= 0.2 * unexplained
+    if len(entries) > 2:
+        confidence -= 0.2  # grid layouts are ambiguous (range vs. list of levels)
+    if sl is not None:
+        lowest, highest = min(entries), max(entries)
+        if (side == "BUY" and sl >= lowest) or (side == "SELL" and sl <= highest):
+            confidence = min(confidence, 0.3)
+    numeric_tps = [tp for tp in tps if isinstance(tp, (int, float))]
+    if numeric_tps and ((side == "BUY" and min(numeric_tps) <= max(entries)) or
+                        (side == "SELL" and max(numeric_tps) >= min(entries))):
+        confidence = min(confidence, 0.3)
+    reference = sum(entries) / len(entries)
+    levels = numeric_tps + ([sl] if sl is not None else [])
+    if reference <= 0 or any(abs(level - reference) > FAST_PATH_MAX_DISTANCE * reference for level in levels):
+        confidence = min(confidence, 0.3)
+    return [idea], max(0.0, round(confidence, 2))
+
+
+def _signals_fingerprint(ideas: List[Dict[str, Any]]) -> set:
+    # Compare what the EA would receive, not how the ideas happen to be written down.
+    def as_float(value):
+        try:
+            return round(float(value), 2)
+        except (TypeError, ValueError):
+            return None
+    return {
+        (sig["instrument"], str(sig["signal"]).upper(), as_float(sig["entry"]), as_float(sig["sl"]), as_float(sig["tp"]))
+        for sig in ideas_to_signals(ideas)
+    }
+
+
+class FastPathStats:
+    """
+    Per-channel counters for the fast path: messages parsed locally vs. sent to the LLM,
+    shadow-mode agreement with the LLM and the (estimated) latency saved.
+    """
+
+    def __init__(self):
+        self.channels: Dict[str, Dict[str, float]] = {}
+        # Moving average of LLM latency, used to estimate what a fast-path hit saved.
+        self.llm_latency_avg = 2.0
+
+    def _channel(self, source: str) -> Dict[str, float]:
+        return self.channels.setdefault(source or "unknown", {
+            "fast_path": 0, "llm": 0, "shadow_compared": 0, "shadow_confident": 0,
+            "shadow_agreed": 0, "latency_saved_s": 0.0,
+        })
+
+    def _observe_llm(self, latency: float):
+        self.llm_latency_avg = 0.9 * self.llm_latency_avg + 0.1 * latency
+
+    def record_fast_path(self, source: str, local_latency: float):
+        channel = self._channel(source)
+        channel["fast_path"] += 1
+        channel["latency_saved_s"] += max(0.0, self.llm_latency_avg - local_latency)
+
+    def record_fallback(self, source: str, llm_latency: float):
+        self._channel(source)["llm"] += 1
+        self._observe_llm(llm_latency)
+
+    def record_shadow(self, source, local_ideas, confidence, llm_ideas, local_latency, llm_latency):
+        channel = self._channel(source)
+        channel["llm"] += 1
+        self._observe_llm(llm_latency)
+        if not llm_ideas:
+            return
+        channel["shadow_compared"] += 1
+        if confidence < FAST_PATH_MIN_CONFIDENCE:
+            return
+        channel["shadow_confident"] += 1
+        if _signals_fingerprint(local_ideas) == _signals_fingerprint(llm_ideas):
+            channel["shadow_agreed"] += 1
+            channel["latency_saved_s"] += max(0.0, llm_latency - local_latency)
+        else:
+            logger.info(f"Fast path disagrees with LLM for {source}: local={local_ideas} llm={llm_ideas}")
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        report = {}
+        for source, channel in self.channels.items():
+            confident = channel["shadow_confident"]
+            report[source] = dict(channel, agreement_rate=channel["shadow_agreed"] / confident if confident else None)
+        return report
+
+
+fast_path_stats = FastPathStats()
+
+
+# ----------------------------------------
+# SIGNAL BLOCK SPLITTING
+# ----------------------------------------
+# Some channels post several independent ideas in one message, either as "* Instrument:"
+# blocks or as one header line (instrument + direction) per idea. Each block is sanitized
+# on its own and concurrently, so the latency is that of the slowest block, and single
+# blocks can often take the fast path. A message is only split if every block carries its
+# own SL or TP, so recaps and lists of results stay in one piece.
+
+SPLIT_SIGNAL_BLOCKS = os.getenv("SANITIZER_SPLIT_BLOCKS", "true").lower() in ("true", "1", "yes")
+INSTRUMENT_MARKER = "* Instrument:"
+
+
+def _is_block_header(line: str) -> bool:
+    return bool(_find_instrument(line)[0] and DIRECTION_RE.search(line))
+
+
+def split_signal_blocks(text: str) -> List[str]:
+    """
+    The independent signal blocks of a message in order, or [text] if it is one signal.
+    """
+    if text.count(INSTRUMENT_MARKER) >= 2:
+        preamble, marked = text[:text.index(INSTRUMENT_MARKER)].strip(), text[text.index(INSTRUMENT_MARKER):]
+        blocks = split_signals(marked)
+        if preamble:
+            blocks[0] = preamble + "\n" + blocks[0]
+    else:
+        blocks, current = [], []
+        for line in text.strip().splitlines():
+            if current and _is_block_header(line) and any(_is_block_header(l) for l in current):
+                blocks.append("\n".join(current))
+                current = []
+            current.append(line)
+        if current:
+            blocks.append("\n".join(current))
+    if len(blocks) < 2 or not all(LABEL_RE.search(block) for block in blocks):
+        return [text]
+    return blocks
+
+# ----------------------------------------
+# PROMPT COMPACTION
+# ----------------------------------------
+# Channel posts carry emojis, marketing lines, links and signatures that the LLM is paid to
+# read and ignore. compact_signal_text() maps the emoji markers channels use for SL/TP to
+# plain labels, folds styled Unicode (bold/full-width letters and digits, fancy dashes) to
+# ASCII and keeps only lines with trading tokens; the LLM and the cache key see that text.
+
+PROMPT_COMPACTION = os.getenv("SANITIZER_PROMPT_COMPACTION", "true").lower() in ("true", "1", "yes")
+
+# Marker emojis that stand for a label; status emojis (✅, ❌) are dropped like any other symbol,
+# since "hit"/"cancelled" would be a guess about what the channel meant.
+EMOJI_TAGS = {"🟣": " SL ", "🟡": " TP ", "🎯": " TP ", "🛑": " SL "}
+DASHES_RE = re.compile(r"[\u2010-\u2015\u2212]")
+SYMBOLS_RE = re.compile(r"[^\w\s.,:;/@+\-=%$()#\[\]'\"!?<>&*]")
+LINK_RE = re.compile(r"https?://\S+|www\.\S+|t\.me/\S+|@\w+", re.IGNORECASE)
+MARKETING_RE = re.compile(r"\b(?:join|subscribe|vip|promo|register|free|channel|group|dm|contact|admin|link)\b",
+                          re.IGNORECASE)
+MANIPULATION_WORDS_RE = re.compile(r"\b(?:close|cancel|break\s*even|move\s+sl|sl\s+to\s+be|set\s+be)\b", re.IGNORECASE)
+
+
+def normalize_markers(text: str) -> str:
+    """
+    Emoji markers -> plain labels, styled Unicode -> ASCII, remaining symbols/emoji dropped.
+    A marker on a line that already has a label ("🎯 TP1: 2410") is dropped, not doubled.
+    """
+    lines = []
+    for line in text.splitlines():
+        bare = line
+        for emoji in EMOJI_TAGS:
+            bare = bare.replace(emoji, " ")
+        if not LABEL_RE.search(unicodedata.normalize("NFKC", bare)):
+            for emoji, tag in EMOJI_TAGS.items():
+                line = line.replace(emoji, tag)
+        lines.append(line)
+    text = unicodedata.normalize("NFKC", "\n".join(lines))
+    text = DASHES_RE.sub("-", text)
+    text = SYMBOLS_RE.sub(" ", text)
+    return "\n".join(re.sub(r"[ \t]+", " ", line).strip() for line in text.splitlines())
+
+
+def _is_trading_line(line: str) -> bool:
+    if (_find_instrument(line)[0] or DIRECTION_RE.search(line) or LABEL_RE.search(line)
+            or ENTRY_LABEL_RE.search(line) or MANIPULATION_WORDS_RE.search(line)):
+        return True
+    # Bare numbers (entry zones, TP lists on their own line) unless the line is advertising
+    return bool(NUMBER_RE.search(line)) and not MARKETING_RE.search(line)
+
+
+def compact_signal_text(text: str) -> str:
+    """
+    The trading-relevant lines of a message, normalized. Falls back to the normalized
+    full text if no line qualifies, so the LLM never gets an empty message.
+    """
+    normalized = normalize_markers(text)
+    lines = [LINK_RE.sub("", line).strip() for line in normalized.splitlines()]
+    kept = [line for line in lines if line and _is_trading_line(line)]
+    return "\n".join(kept) if kept else "\n".join(line for line in lines if line)
+
+
+def _llm_text(signal_text: str) -> str:
+    return compact_signal_text(signal_text) if PROMPT_COMPACTION else signal_text
+
+
+class CompactionStats:
+    """
+    Per-channel input token counts of LLM requests before and after compaction.
+    """
+
+    def __init__(self):
+        self.channels: Dict[str, Dict[str, float]] = {}
+        self._prompt_tokens = count_tokens(ai_prompt.format(text=""))
+
+    def record(self, source: str, original: str, compacted: str) -> int:
+        """
+        Records one LLM request; returns its prompt tokens.
+        """
+        before, after = count_tokens(original), count_tokens(compacted)
+        channel = self.channels.setdefault(source or "unknown", {
+            "requests": 0, "message_tokens_before": 0, "message_tokens_after": 0, "prompt_tokens": 0,
+        })
+        channel["requests"] += 1
+        channel["message_tokens_before"] += before
+        channel["message_tokens_after"] += after
+        channel["prompt_tokens"] += self._prompt_tokens + after
+        return self._prompt_tokens + after
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        report = {}
+        for source, channel in self.channels.items():
+            before, after = channel["message_tokens_before"], channel["message_tokens_after"]
+            saved = before - after
+            report[source] = dict(
+                channel,
+                message_reduction=round(saved / before, 3) if before else None,
+                prompt_reduction=round(saved / (channel["prompt_tokens"] + saved), 3) if before else None,
+            )
+        return report
+
+
+compaction_stats = CompactionStats()
+
+
+# ----------------------------------------
+# BATCHED EXTRACTION (historical replay)
+# ----------------------------------------
+# A backfill would otherwise make one sequential LLM call per message. sanitize_batch()
+# packs many messages into one prompt, tagged with IDs, and maps the returned ideas back.
+# Batches are sized to the model's context, sent concurrently at backfill priority (see
+# llm_scheduler.py), and only the items missing from a bad or partial answer are retried,
+# in smaller batches.
+
+AI_CONTEXT_TOKENS = int(os.getenv("AI_CONTEXT_TOKENS", "8192"))
+AI_BATCH_MAX_MESSAGES = int(os.getenv("AI_BATCH_MAX_MESSAGES", "20"))
+AI_BATCH_TIMEOUT = float(os.getenv("AI_BATCH_TIMEOUT", "60"))
+AI_BATCH_RETRIES = int(os.getenv("AI_BATCH_RETRIES", "2"))
+# Rough completion budget per message (one or two ideas of ~60 tokens each)
+AI_BATCH_OUTPUT_TOKENS_PER_MESSAGE = 150
+
+# Same rules as ai_prompt; the tagged messages are appended (no str.format: the rules contain braces).
+ai_batch_prompt = ai_prompt.format(text="").rstrip() + """
+
+You will receive SEVERAL independent messages, each starting with a line "### MESSAGE <id>".
+Apply the rules above to every message separately. Output ONE JSON object and nothing else:
+
+{"results": [{"id": "<id>", "ideas": [<one JSON object per trade idea, format as above>]}, ...]}
+
+Include every id exactly once. Use "ideas": [] for messages that contain no trade signal.
+
+"""
+
+# cache key -> ideas extracted by sanitize_batch, consumed by the next sanitize_signal for that text
+_primed_ideas: Dict[str, List[Dict[str, Any]]] = {}
+
+
+def _pack_batches(items: List[tuple], max_messages: int) -> List[List[tuple]]:
+    budget = AI_CONTEXT_TOKENS - estimate_tokens(ai_batch_prompt)
+    batches, current, used = [], [], 0
+    for item in items:
+        cost = estimate_tokens(item[1]) + 10 + AI_BATCH_OUTPUT_TOKENS_PER_MESSAGE
+        if current and (used + cost > budget or len(current) >= max_messages):
+            batches.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _parse_batch_output(ai_output: str) -> Dict[str, List[Dict[str, Any]]]:
+    # Per-message results are picked up individually, so a truncated answer still yields
+    # the results that were complete and only the rest is retried.
+    parsed = {}
+    for obj in iter_json_objects(ai_output or ""):
+        if isinstance(obj, dict) and "id" in obj and isinstance(obj.get("ideas"), list):
+            parsed[str(obj["id"])] = [i for i in obj["ideas"] if is_idea(i)]
+    return parsed
+
+
+async def _run_batch(batch: List[tuple]) -> Dict[str, List[Dict[str, Any]]]:
+    llm_priority.set(PRIORITY_BACKFILL)  # runs as its own task (gather), so this does not leak
+    messages = "\n\n".join(f"### MESSAGE {item_id}\n{text.strip()}" for item_id, text in batch)
+    ai_output = await complete_prompt(ai_batch_prompt + messages, timeout=AI_BATCH_TIMEOUT,
+                                      validate=lambda output: bool(_parse_batch_output(output)), hedge=False)
+    parsed = _parse_batch_output(ai_output)
+    return {item_id: parsed[item_id] for item_id, _ in batch if item_id in parsed}
+
+
+async def sanitize_batch(messages: List[tuple]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Extracts ideas for many (id, text) messages with as few LLM calls as possible.
+    Returns {id: ideas} for every message that was extracted; ids missing from the result
+    failed in all rounds and should go through sanitize_signal individually.
+    """
+    pending = [(str(item_id), text) for item_id, text in messages]
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    max_messages = AI_BATCH_MAX_MESSAGES
+    for attempt in range(AI_BATCH_RETRIES + 1):
+        if not pending:
+            break
+        batches = _pack_batches(pending, max_messages)
+        logger.info(f"Batch sanitization round {attempt + 1}: {len(pending)} messages in {len(batches)} LLM calls.")
+        for batch_result in await asyncio.gather(*(_run_batch(b) for b in batches)):
+            results.update(batch_result)
+        pending = [item for item in pending if item[0] not in results]
+        max_messages = max(1, max_messages // 2)
+    if pending:
+        logger.warning(f"Batch sanitization gave up on {len(pending)} messages; they will be sanitized one by one.")
+    return results
+
+
+async def prime_sanitizer(messages: List[tuple]) -> int:
+    """
+    Runs sanitize_batch over the (id, text) messages that sanitize_signal would send to the LLM
+    (not cached, not handled by the fast path), block by block for multi-block posts, and keeps
+    the results for it. Returns the number of messages/blocks primed.
+    """
+    todo, keys = [], set()
+    for item_id, text in messages:
+        # Wie sanitize_signal: Posts mit mehreren Signalblöcken werden blockweise nachgeschlagen
+        blocks = split_signal_blocks(text) if SPLIT_SIGNAL_BLOCKS else [text]
+        for index, block in enumerate(blocks):
+            if FAST_PATH_MODE == "on" and parse_signal_locally(block)[1] >= FAST_PATH_MIN_CONFIDENCE:
+                continue
+            block = _llm_text(block)
+            key = make_cache_key(block, PROMPT_VERSION, CACHE_MODEL_ID)
+            if key in keys or key in _primed_ideas or (
+                    LLM_CACHE_ENABLED and await asyncio.to_thread(sanitizer_cache.contains, key)):
+                continue
+            keys.add(key)
+            todo.append((item_id if len(blocks) == 1 else f"{item_id}-{index}", block, key))
+    if not todo:
+        return 0
+
+    started = time.perf_counter()
+    results = await sanitize_batch([(item_id, text) for item_id, text, _ in todo])
+    latency_share = (time.perf_counter() - started) / len(todo)
+    for item_id, text, key in todo:
+        ideas = results.get(str(item_id))
+        if ideas is None:
+            continue
+        _primed_ideas[key] = ideas
+        if ideas and LLM_CACHE_ENABLED:
+            await asyncio.to_thread(sanitizer_cache.put, key, ideas, latency_share)
+    return sum(1 for _, _, key in todo if key in _primed_ideas)
+
+
+def clear_primed() -> int:
+    """
+    Drops primed results that sanitize_signal never picked up (call after a replay). Returns the count.
+    """
+    unused = len(_primed_ideas)
+    _primed_ideas.clear()
+    return unused
+
+
 # --- TP calculation helper ---
 
 # --- TP assignment helper ---
@@ -0,0 +1,160 @@
+# signal_batch.py
+"""
+Ordered, key-indexed container for the entries of one signal batch.
+
+process_sanitized_signal used to rebuild a signal's batch on every message: extend,
+re-deduplicate the whole list by signal_key and re-sort it by time. SignalBatch keeps
+the entries indexed by key and ordered by (time, first insertion), so an update only
+touches the entry it adds or replaces, and the JSON document written for the EA is
+assembled from per-entry fragments that are serialized once.
+"""
+import json
+from bisect import bisect_left, insort
+from itertools import chain
+from typing import Callable, Iterable, Iterator
+
+EPOCH = "1970-01-01T00:00:00Z"
+# Bucket size of SortedBuckets (the layout sortedcontainers.SortedList uses)
+BUCKET_LOAD = 64
+
+
+def entry_time(entry: dict) -> str:
+    # ISO-8601 strings sort chronologically; entries without a time go first.
+    return entry.get("time") or EPOCH
+
+
+class SortedBuckets:
+    """
+    Sorted sequence stored as a list of buckets of at most 2 * load items, with the
+    maximum of each bucket kept in a separate list. add() and remove() bisect the
+    maxima (O(log n)) and then one bucket (O(log load)), and only move items inside
+    that bucket (O(load), independent of n). A full bucket is split in two, which
+    shifts the bucket list once every ~load inserts.
+    """
+
+    def __init__(self, load: int = BUCKET_LOAD):
+        self._load = load
+        self._buckets: list[list] = []
+        self._maxes: list = []
+        self._len = 0
+
+    def add(self, value):
+        if not self._buckets:
+            self._buckets.append([value])
+            self._maxes.append(value)
+        else:
+            i = bisect_left(self._maxes, value)
+            if i == len(self._maxes):
+                # Neuer Höchstwert: an den letzten Bucket anhängen (der Normalfall, Nachrichten kommen in Zeitfolge)
+                i -= 1
+                self._buckets[i].append(value)
+                self._maxes[i] = value
+            else:
+                insort(self._buckets[i], value)
+            bucket = self._buckets[i]
+            if len(bucket) > 2 * self._load:
+                self._buckets.insert(i + 1, bucket[self._load:])
+                del bucket[self._load:]
+                self._maxes[i] = bucket[-1]
+                self._maxes.insert(i + 1, self._buckets[i + 1][-1])
+        self._len += 1
+
+    def remove(self, value):
+        i = bisect_left(self._maxes, value)
+        bucket = self._buckets[i] if i < len(self._buckets) else []
+        j = bisect_left(bucket, value)
+        if j == len(bucket) or bucket[j] != value:
+            raise ValueError(f"{value!r} not in SortedBuckets")
+        del bucket[j]
+        if bucket:
+            self._maxes[i] = bucket[-1]
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+        self._len -= 1
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator:
+        return chain.from_iterable(self._buckets)
+
+
+class SignalBatch:
+    """
+    Entries deduplicated by key_fn, iterated in chronological order.
+
+    Replacing an entry keeps the position of its first insertion among entries with
+    the same time (same as the previous dict-based deduplication + stable sort).
+    Entries are treated as immutable once added; upsert() a new dict to change one.
+
+    upsert() is O(log n): a dict lookup plus add/remove in the SortedBuckets order.
+    serialize() is O(n) but only re-serializes entries changed since the last call.
+    """
+
+    def __init__(self, key_fn: Callable[[dict], tuple], entries: Iterable[dict] = ()):
+        self.key_fn = key_fn
+        self._entries: dict[tuple, dict] = {}
+        self._seq: dict[tuple, int] = {}          # key -> first insertion number
+        self._keys: dict[int, tuple] = {}         # insertion number -> key
+        self._order = SortedBuckets()             # sorted (time, insertion number)
+        self._fragments: dict[tuple, str] = {}    # key -> serialized entry
+        self._next_seq = 0
+        for entry in entries:
+            self.upsert(entry)
+
+    def upsert(self, entry: dict):
+        key = self.key_fn(entry)
+        seq = self._seq.get(key)
+        if seq is None:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._seq[key] = seq
+            self._keys[seq] = key
+        else:
+            self._order.remove((entry_time(self._entries[key]), seq))
+            self._fragments.pop(key, None)
+        self._entries[key] = entry
+        # Messages arrive roughly in time order, so this is usually an append to the last bucket.
+        self._order.add((entry_time(entry), seq))
+
+    def extend(self, entries: Iterable[dict]):
+        for entry in entries:
+            self.upsert(entry)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __iter__(self) -> Iterator[dict]:
+        for _, seq in self._order:
+            yield self._entries[self._keys[seq]]
+
+    def to_list(self) -> list[dict]:
+        return list(self)
+
+    def _fragment(self, key: tuple) -> str:
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            # Indented to its depth inside {"signals": [...]} so the joined document
+            # is byte-identical to json.dumps({"signals": entries}, indent=2).
+            fragment = "\n".join("    " + line for line in json.dumps(self._entries[key], indent=2).splitlines())
+            self._fragments[key] = fragment
+        return fragment
+
+    def iter_serialized(self) -> Iterator[str]:
+        """
+        Yields the batch document {"signals": [...]} chunk by chunk; only entries
+        added or replaced since the last call are serialized again.
+        """
+        if not self._order:
+            yield '{\n  "signals": []\n}'
+            return
+        yield '{\n  "signals": [\n'
+        for i, (_, seq) in enumerate(self._order):
+            if i:
+                yield ",\n"
+            yield self._fragment(self._keys[seq])
+        yield "\n  ]\n}"
+
+    def serialize(self) -> str:
+        return "".join(self.iter_serialized())
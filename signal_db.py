@@ -1,75 +1,344 @@
 import sqlite3
 import os
+import json
 import uuid
+import logging
+import threading
+import atexit
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger("signalworker.db")
 
 DB_PATH = os.getenv("SIGNAL_DB_PATH", "signal_mapping.db")
+# In WAL mode NORMAL only fsyncs at checkpoints: a commit survives an application crash,
+# only a power loss / OS crash can roll back the most recent transactions.
+DB_SYNCHRONOUS = os.getenv("SIGNAL_DB_SYNCHRONOUS", "NORMAL").upper()
+DB_BUSY_TIMEOUT = float(os.getenv("SIGNAL_DB_BUSY_TIMEOUT", "5"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("SIGNAL_DB_STATEMENT_CACHE_SIZE", "64"))
+# Write-behind for entries rows: flush after this many rows or this many seconds,
+# whichever comes first. A flush size of 1 writes every row synchronously.
+ENTRY_FLUSH_SIZE = int(os.getenv("SIGNAL_DB_ENTRY_FLUSH_SIZE", "32"))
+ENTRY_FLUSH_INTERVAL = float(os.getenv("SIGNAL_DB_ENTRY_FLUSH_INTERVAL", "0.5"))
+# Read-through cache for telegram_message_id -> signalid. TTL 0 disables expiry, size 0 the cache.
+SIGNAL_ID_CACHE_SIZE = int(os.getenv("SIGNAL_ID_CACHE_SIZE", "2048"))
+SIGNAL_ID_CACHE_TTL = float(os.getenv("SIGNAL_ID_CACHE_TTL", "86400"))
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    # Parent signals (1 row per Telegram message)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS signals (
-            telegram_message_id INTEGER PRIMARY KEY,
-            signalid TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Child entries (1 row per trade entry or manipulation linked to a signal)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS entries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            signalid TEXT NOT NULL,
-            telegram_message_id INTEGER,
-            type TEXT,          -- "entry" or "manipulation"
-            payload TEXT,       -- JSON payload for debugging/logging
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (signalid) REFERENCES signals(signalid)
+# SQL is kept in module constants so every call hands sqlite3 the identical string
+# and hits the per-connection prepared statement cache.
+SQL_INSERT_SIGNAL = "INSERT OR IGNORE INTO signals (telegram_message_id, signalid) VALUES (?, ?)"
+SQL_SELECT_SIGNALID = "SELECT signalid FROM signals WHERE telegram_message_id = ?"
+# The no-op DO UPDATE makes RETURNING yield the existing row on conflict (DO NOTHING returns nothing).
+SQL_GET_OR_CREATE_SIGNAL = """
+    INSERT INTO signals (telegram_message_id, signalid) VALUES (?, ?)
+    ON CONFLICT (telegram_message_id) DO UPDATE SET signalid = signalid
+    RETURNING signalid
+"""
+SQL_INSERT_ENTRY = """
+    INSERT INTO entries (signalid, telegram_message_id, type, payload, created_at)
+    VALUES (?, ?, ?, ?, ?)
+"""
+# Schema changes applied on top of the base tables by init_db(), tracked in PRAGMA user_version.
+# Append only: the position of a step is its version number.
+MIGRATIONS: list[tuple[str, ...]] = [
+    # 1: a signal's history and a message's entries without full table scans
+    (
+        "CREATE INDEX IF NOT EXISTS idx_entries_signalid ON entries (signalid, id)",
+        "CREATE INDEX IF NOT EXISTS idx_entries_telegram_message_id ON entries (telegram_message_id)",
+    ),
+]
+
+SQL_SELECT_ENTRIES = """
+    SELECT telegram_message_id, type, payload, created_at
+    FROM entries WHERE signalid = ? ORDER BY id
+"""
+
+
+class ConnectionManager:
+    """
+    Hands out one long-lived SQLite connection per thread.
+
+    sqlite3 connections must not be used by two threads at once, so each thread gets
+    its own connection (opened lazily, configured once). Connections of threads that
+    have finished are closed the next time a new connection is opened.
+    """
+
+    def __init__(self, path: str, synchronous: str = DB_SYNCHRONOUS,
+                 busy_timeout: float = DB_BUSY_TIMEOUT,
+                 cached_statements: int = DB_STATEMENT_CACHE_SIZE):
+        self.path = path
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: dict[threading.Thread, sqlite3.Connection] = {}
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._close_dead_threads()
+                self._connections[threading.current_thread()] = conn
+        return conn
+
+    def _open(self) -> sqlite3.Connection:
+        # check_same_thread=False only so close_all() may close connections owned by
+        # other threads; during normal operation a connection never leaves its thread.
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
         )
-    """)
+        mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        logger.debug(f"Opened SQLite connection to {self.path} (journal_mode={mode}, "
+                     f"synchronous={self.synchronous}) in {threading.current_thread().name}.")
+        return conn
 
-    conn.commit()
-    conn.close()
+    def _close_dead_threads(self):
+        for thread in [t for t in self._connections if not t.is_alive()]:
+            self._connections.pop(thread).close()
 
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+        # The calling thread may reconnect later; drop its stale handle.
+        self._local = threading.local()
 
-def get_signalid(telegram_message_id: int) -> str | None:
+
+class EntryJournal:
     """
-    Retrieves the persistent signalid (UUID) associated with a given Telegram message ID.
+    Write-behind queue for rows of the entries table.
 
-    This is used for:
-    1. New signals: To check if a signal ID was already generated.
-    2. Manipulations: To find the original signal ID via the reply_to_msg_id.
+    append() only buffers the row; a background thread writes the buffer in one
+    transaction once ENTRY_FLUSH_SIZE rows are pending or the oldest pending row is
+    ENTRY_FLUSH_INTERVAL seconds old. flush() writes everything pending and returns
+    only after the commit; readers use frozen() to see queued rows without forcing one.
     """
-    if not isinstance(telegram_message_id, int):
-        logger.error(f"Invalid message ID type provided: {type(telegram_message_id)}")
-        return None
 
-    # Replace with database lookup: e.g., db.fetch_signalid(telegram_message_id)
-    signal_id = MESSAGE_ID_TO_SIGNAL_ID.get(telegram_message_id)
+    def __init__(self, flush_size: int = ENTRY_FLUSH_SIZE, flush_interval: float = ENTRY_FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending: list[tuple] = []
+        self._cond = threading.Condition()
+        # Held for the whole take-and-commit, so a returning flush() implies every row
+        # appended before it is on disk (even if the background thread took them).
+        self._flush_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def append(self, row: tuple):
+        with self._cond:
+            self._pending.append(row)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="signal-db-journal", daemon=True)
+                self._thread.start()
+            if len(self._pending) == 1 or len(self._pending) >= self.flush_size:
+                self._cond.notify()
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._pending)
 
-    if signal_id:
-        logger.debug(f"Found signal ID {signal_id} for message ID {telegram_message_id}.")
-    else:
-        logger.debug(f"No signal ID found for message ID {telegram_message_id}.")
+    @contextmanager
+    def frozen(self):
+        """
+        Blocks flushing while held and yields a snapshot of the queued rows, so a
+        table read inside the block plus the snapshot sees every row exactly once.
+        """
+        with self._flush_lock:
+            with self._cond:
+                snapshot = list(self._pending)
+            yield snapshot
 
-    return signal_id
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                self._cond.wait_for(lambda: len(self._pending) >= self.flush_size, timeout=self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # Rows were put back by flush(); back off for one interval and retry.
+                threading.Event().wait(self.flush_interval)
 
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._cond:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            conn = get_connection()
+            try:
+                with conn:
+                    conn.executemany(SQL_INSERT_ENTRY, rows)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to flush {len(rows)} entries, keeping them queued: {e}")
+                with self._cond:
+                    self._pending[:0] = rows
+                raise
+            logger.debug(f"Flushed {len(rows)} entries in one transaction.")
+            return len(rows)
 
-def store_signalid(telegram_message_id: int) -> str:
+
+class SignalIdCache:
+    """
+    Bounded LRU of telegram_message_id -> signalid with optional TTL.
+
+    Mappings are never updated once written, so a cached value can only go stale by
+    expiring; only confirmed mappings are cached, misses are not.
+    """
+
+    def __init__(self, maxsize: int = SIGNAL_ID_CACHE_SIZE, ttl: float = SIGNAL_ID_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[int, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, telegram_message_id: int) -> str | None:
+        with self._lock:
+            item = self._data.get(telegram_message_id)
+            if item is None:
+                self.misses += 1
+                return None
+            signalid, stored_at = item
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._data[telegram_message_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(telegram_message_id)
+            self.hits += 1
+            return signalid
+
+    def put(self, telegram_message_id: int, signalid: str):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[telegram_message_id] = (signalid, time.monotonic())
+            self._data.move_to_end(telegram_message_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_manager = ConnectionManager(DB_PATH)
+_journal = EntryJournal()
+_signalid_cache = SignalIdCache()
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Returns the calling thread's pooled connection to DB_PATH.
     """
-    Generates a new UUID signalid and stores the mapping to the Telegram message ID.
+    return _manager.connection()
 
-    This is called only when processing a NEW signal for the first time.
+
+def flush() -> int:
+    """
+    Durably writes all queued entries rows. Returns the number of rows written.
     """
-    new_signal_id = str(uuid.uuid4())
+    return _journal.flush()
+
+
+def close_db():
+    """
+    Flushes queued entries and closes all pooled connections (call on shutdown).
+    """
+    _journal.flush()
+    _manager.close_all()
+
+
+def cache_stats() -> dict:
+    """
+    Hit/miss/eviction counters of the signalid read-through cache.
+    """
+    return _signalid_cache.stats()
+
+
+def init_db():
+    conn = get_connection()
+    with conn:
+        # Parent signals (1 row per Telegram message)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS signals (
+                telegram_message_id INTEGER PRIMARY KEY,
+                signalid TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Child entries (1 row per trade entry or manipulation linked to a signal)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                signalid TEXT NOT NULL,
+                telegram_message_id INTEGER,
+                type TEXT,          -- "entry" or "manipulation"
+                payload TEXT,       -- JSON payload for debugging/logging
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (signalid) REFERENCES signals(signalid)
+            )
+        """)
+
+    migrate(conn)
+
+
+def migrate(conn: sqlite3.Connection):
+    """
+    Applies all MIGRATIONS newer than the database's user_version. Each step runs with its
+    user_version bump in one explicit transaction: the sqlite3 module does not open one for
+    DDL or PRAGMA, so a crash could otherwise leave the schema half-migrated.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    while True:
+        # IMMEDIATE: a second process migrating at the same time waits and then sees the new version
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.execute("COMMIT")
+                return
+            for statement in MIGRATIONS[version]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        logger.info(f"Migrated {DB_PATH} to schema version {version + 1}.")
 
-    # Replace with database storage: e.g., db.save_mapping(telegram_message_id, new_signal_id)
-    MESSAGE_ID_TO_SIGNAL_ID[telegram_message_id] = new_signal_id
 
-    logger.info(f"Stored new signal ID {new_signal_id} for message ID {telegram_message_id}.")
-    return new_signal_id
 def store_signalid(telegram_message_id: int, signalid: str = None) -> str:
     """
     Save one signalid for the given Telegram parent message.
@@ -78,33 +347,86 @@ def store_signalid(telegram_message_id: int, signalid: str = None) -> str:
     if not signalid:
         signalid = str(uuid.uuid4())
 
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO signals (telegram_message_id, signalid) VALUES (?, ?)",
-                (telegram_message_id, signalid))
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        inserted = conn.execute(SQL_INSERT_SIGNAL, (telegram_message_id, signalid)).rowcount
+    # INSERT OR IGNORE keeps an existing mapping, in which case `signalid` is not what is stored.
+    if inserted:
+        _signalid_cache.put(telegram_message_id, signalid)
     return signalid
 
 
 def get_signalid(telegram_message_id: int) -> str | None:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT signalid FROM signals WHERE telegram_message_id = ?", (telegram_message_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else None
+    signalid = _signalid_cache.get(telegram_message_id)
+    if signalid:
+        return signalid
+    row = get_connection().execute(SQL_SELECT_SIGNALID, (telegram_message_id,)).fetchone()
+    if not row:
+        return None
+    _signalid_cache.put(telegram_message_id, row[0])
+    return row[0]
+
+
+def get_or_create_signalid(telegram_message_id: int, default: str = None) -> str:
+    """
+    Atomically returns the signalid mapped to the Telegram message, storing `default`
+    (or a fresh UUID) first if the message has no mapping yet. One statement, one
+    transaction, so concurrent events for the same message always agree on the ID.
+    """
+    signalid = _signalid_cache.get(telegram_message_id)
+    if signalid:
+        return signalid
+    candidate = default or str(uuid.uuid4())
+    conn = get_connection()
+    with conn:
+        row = conn.execute(SQL_GET_OR_CREATE_SIGNAL, (telegram_message_id, candidate)).fetchone()
+    _signalid_cache.put(telegram_message_id, row[0])
+    return row[0]
 
 
 def add_entry(signalid: str, telegram_message_id: int, entry_type: str, payload: str):
     """
     Add a child entry (trade split or manipulation) linked to a master signalid.
+    The row is queued in the write-behind journal; see flush().
+    """
+    created_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    row = (signalid, telegram_message_id, entry_type, payload, created_at)
+    if _journal.flush_size <= 1:
+        conn = get_connection()
+        with conn:
+            conn.execute(SQL_INSERT_ENTRY, row)
+        return
+    _journal.append(row)
+
+
+def get_entries(signalid: str) -> list[dict]:
+    """
+    Returns all entries rows of a signal in insertion order, including rows that
+    are still queued in the journal.
+    """
+    with _journal.frozen() as pending:
+        rows = get_connection().execute(SQL_SELECT_ENTRIES, (signalid,)).fetchall()
+    # Queued rows are always newer than committed ones (the queue is FIFO).
+    rows += [row[1:] for row in pending if row[0] == signalid]
+    return [
+        {"telegram_message_id": msg_id, "type": entry_type, "payload": payload, "created_at": created_at}
+        for msg_id, entry_type, payload, created_at in rows
+    ]
+
+
+def load_batch(signalid: str) -> list[dict]:
+    """
+    Rebuilds a signal's entry list (decoded payloads) from the entries table,
+    in chronological order; rows with the same time keep their insertion order.
     """
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO entries (signalid, telegram_message_id, type, payload)
-        VALUES (?, ?, ?, ?)
-    """, (signalid, telegram_message_id, entry_type, payload))
-    conn.commit()
-    conn.close()
+    batch = []
+    for row in get_entries(signalid):
+        try:
+            batch.append(json.loads(row["payload"]))
+        except (TypeError, json.JSONDecodeError) as e:
+            logger.warning(f"Skipping unreadable entry payload for signal {signalid}: {e}")
+    batch.sort(key=lambda s: s.get("time") or "1970-01-01T00:00:00Z")
+    return batch
+
+
+atexit.register(flush)
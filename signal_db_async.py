@@ -0,0 +1,55 @@
+# signal_db_async.py
+"""
+Async facade for signal_db.
+
+Every call is handed to one dedicated "signal-db" worker thread, so coroutines on the
+Telethon event loop never block on SQLite and all writes from async code go through a
+single connection in submission order.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import signal_db
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="signal-db")
+
+
+async def _run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def get_signalid(telegram_message_id: int) -> str | None:
+    return await _run(signal_db.get_signalid, telegram_message_id)
+
+
+async def store_signalid(telegram_message_id: int, signalid: str = None) -> str:
+    return await _run(signal_db.store_signalid, telegram_message_id, signalid)
+
+
+async def get_or_create_signalid(telegram_message_id: int, default: str = None) -> str:
+    return await _run(signal_db.get_or_create_signalid, telegram_message_id, default)
+
+
+async def add_entry(signalid: str, telegram_message_id: int, entry_type: str, payload: str):
+    return await _run(signal_db.add_entry, signalid, telegram_message_id, entry_type, payload)
+
+
+async def get_entries(signalid: str) -> list[dict]:
+    return await _run(signal_db.get_entries, signalid)
+
+
+async def load_batch(signalid: str) -> list[dict]:
+    return await _run(signal_db.load_batch, signalid)
+
+
+async def flush() -> int:
+    return await _run(signal_db.flush)
+
+
+async def close():
+    """
+    Flushes the journal and closes the connections, on the same worker thread as all other calls.
+    """
+    return await _run(signal_db.close_db)
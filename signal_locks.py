@@ -0,0 +1,53 @@
+# signal_locks.py
+"""
+Registry of asyncio locks keyed by signal ID.
+
+Messages about different signals are processed concurrently; messages about the
+same signal (the original and its replies) are serialized on that signal's lock.
+A lock exists only while some task holds or waits for it, so the registry does not
+grow with the number of signals ever seen.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class KeyedAsyncLock:
+    """
+    One asyncio.Lock per key, created on first use and dropped when idle.
+    Must only be used from a single event loop.
+    """
+
+    def __init__(self):
+        self._locks: dict[object, list] = {}  # key -> [asyncio.Lock, holders + waiters]
+        self.acquisitions = 0
+        self.contended = 0
+        self.max_active = 0
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.max_active = max(self.max_active, len(self._locks))
+        if entry[0].locked():
+            self.contended += 1
+        try:
+            async with entry[0]:
+                self.acquisitions += 1
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._locks),
+            "max_active": self.max_active,
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+        }
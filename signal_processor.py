@@ -1,3 +1,5 @@
+import asyncio
+import heapq
 import time
 import threading
 import logging
@@ -6,7 +8,10 @@ from dotenv import load_dotenv
 from utils import log_to_google_sheets, update_existing_signal
 from dropbox_writer import store_signal_batch
 import uuid
-from signal_db import store_signalid, get_signalid, add_entry
+from signal_db_async import get_signalid, get_or_create_signalid, add_entry, load_batch
+from signal_store import BoundedSignalStore
+from signal_batch import SignalBatch
+from signal_locks import KeyedAsyncLock
 import json
 import os
 
@@ -19,11 +24,21 @@ sent_signal_lock = threading.Lock()
 app = Flask(__name__)
 logger = logging.getLogger("signalworker.processor")
 
+# Bounds for the in-memory per-signal state; evicted batches are recovered from signal_db on demand.
+SIGNAL_STORE_MAX_ENTRIES = int(os.getenv("SIGNAL_STORE_MAX_ENTRIES", "1000"))
+SIGNAL_STORE_MAX_AGE = float(os.getenv("SIGNAL_STORE_MAX_AGE", str(7 * 24 * 3600)))
+# Pending signals without an EA status update are invalidated after this many seconds.
+SIGNAL_EXPIRATION_SECONDS = float(os.getenv("SIGNAL_EXPIRATION_SECONDS", "3600"))
+
 # In-memory lifecycle signal state tracking
-signal_states = {}
+signal_states = BoundedSignalStore("signal_states", SIGNAL_STORE_MAX_ENTRIES, SIGNAL_STORE_MAX_AGE)
 lock = threading.Lock()
-signal_batches = {}
-manipulation_counters = {}  # memory map signalid -> manipulation count
+signal_batches = BoundedSignalStore("signal_batches", SIGNAL_STORE_MAX_ENTRIES, SIGNAL_STORE_MAX_AGE)
+# memory map signalid -> manipulation count
+manipulation_counters = BoundedSignalStore("manipulation_counters", SIGNAL_STORE_MAX_ENTRIES, SIGNAL_STORE_MAX_AGE)
+# Serializes processing per main_signalid; different signals are processed concurrently.
+# (`lock` above stays a threading.Lock: signal_states is also touched from Flask request threads.)
+signal_locks = KeyedAsyncLock()
 
 CHANNEL_CONFIG = {
     "🌸NOVA - GOLD PLATINUM 🎀": {
@@ -58,6 +73,11 @@ def ea_status_update():
     return jsonify({"status": "ok"}), 200
 
 
+@app.route("/signal-store-stats", methods=["GET"])
+def signal_store_stats():
+    return jsonify([store.stats() for store in (signal_batches, signal_states, manipulation_counters)]), 200
+
+
 def signal_unique_key(signal: dict) -> tuple:
     # Define uniqueness; example includes manipulation, telegram_message_id, instrument, entry price, etc.
     return (
@@ -80,18 +100,25 @@ def signal_key(sig):
     )
 
 
+async def _load_batch(signalid):
+    # Rebuild an evicted (or never seen) batch from the entries table, deduplicated like the live batch
+    return SignalBatch(signal_key, await load_batch(signalid))
+
+
 def send_signal_with_tracking(signal):
     signalid = signal["signalid"]
 
     # Track signal lifecycle state
+    sent_time = time.time()
     with lock:
         signal_states[signalid] = {
-            "sent_time": time.time(),
+            "sent_time": sent_time,
             "status": "pending",
             "signal": signal,
-            "last_update": time.time(),
-            "history": [("pending", time.time())]
+            "last_update": sent_time,
+            "history": [("pending", sent_time)]
         }
+    signal_expiry.schedule(signalid, sent_time)
 
     manipulation_count = 0
     if signal.get("manipulation"):
@@ -149,165 +176,215 @@ async def process_sanitized_signal(
     main_signalid = None
 
     # 1. Determine main_signalid
-    if is_manipulation and reply_to_msg_id:
+    if override_signalid:
+        # Already resolved by the handler (get_or_create_signalid) - no second DB round trip
+        main_signalid = override_signalid
+    elif is_manipulation and reply_to_msg_id:
         # Manipulation: Fetch ID of the original signal using the reply ID
-        main_signalid = get_signalid(reply_to_msg_id)
+        main_signalid = await get_signalid(reply_to_msg_id)
         if not main_signalid:
             logger.warning(
                 f"Manipulation received but original signal ID not found for reply_to_msg_id: {reply_to_msg_id}")
             return
     elif telegram_message_id:
         # New Signal: Get existing ID or create a new one
-        main_signalid = get_signalid(telegram_message_id) or store_signalid(telegram_message_id)
+        main_signalid = await get_or_create_signalid(telegram_message_id)
 
     if not main_signalid:
         logger.warning("Could not determine main_signalid.")
         return
 
-    # Get the current in-memory batch (the state of the existing signal entries)
-    current_batch = signal_batches.setdefault(main_signalid, [])
-
-    # --- Start Data Merging Logic for Manipulation ---
-
-    if is_manipulation and current_batch:
-        logger.info(f"Applying manipulation data for signal ID: {main_signalid}")
-        manipulation_data = first_signal  # The sanitized object containing new 'sl' and/or 'tp'
-
-        # NEUER EINTRAG FÜR MANIPULATION:
-        # Manipulationen werden nun als eigenständiger Eintrag mit dem Zeitstempel der Manipulation hinzugefügt,
-        # anstatt die bestehenden Einträge zu überschreiben.
-
-        # Kontextfelder für den neuen Manipulationseintrag füllen
-        new_manipulation_entry = {
-            "signalid": main_signalid,
-            "manipulation": manipulation_data.get("manipulation"),
-            "instrument": manipulation_data.get("instrument"),
-            "link": make_telegram_link(link) if link else None,
-            "source": source,
-            "time": timestamp,
-            "telegram_message_id": telegram_message_id
-            # Optional: Übernehmen von SL/TP-Updates, falls vorhanden,
-            # obwohl das "manipulation"-Feld in der Regel die Aktion beschreibt.
-        }
-
-        # Hinzufügen des Manipulationseintrags zur Batch
-        current_batch.append(new_manipulation_entry)
-
-        # Die ursprüngliche Logik zur Aktualisierung der SL/TP-Werte in der Batch
-        # ist für die meisten Manipulationsarten NICHT gewünscht, da sie historische
-        # Daten überschreibt. Wir entfernen die Logik, die in-place die SL/TPs aller
-        # vorherigen Einträge ändert, um eine saubere Historie zu gewährleisten.
+    async with signal_locks.hold(main_signalid):
+        # Get the current in-memory batch (the state of the existing signal entries).
+        # Not in memory (evicted, or after a restart): recover it from the entries table.
+        current_batch = await signal_batches.get_or_load(main_signalid, _load_batch)
+
+        # --- Start Data Merging Logic for Manipulation ---
+
+        if is_manipulation and current_batch:
+            logger.info(f"Applying manipulation data for signal ID: {main_signalid}")
+            manipulation_data = first_signal  # The sanitized object containing new 'sl' and/or 'tp'
+
+            # NEUER EINTRAG FÜR MANIPULATION:
+            # Manipulationen werden nun als eigenständiger Eintrag mit dem Zeitstempel der Manipulation hinzugefügt,
+            # anstatt die bestehenden Einträge zu überschreiben.
+
+            # Kontextfelder für den neuen Manipulationseintrag füllen
+            new_manipulation_entry = {
+                "signalid": main_signalid,
+                "manipulation": manipulation_data.get("manipulation"),
+                "instrument": manipulation_data.get("instrument"),
+                "link": make_telegram_link(link) if link else None,
+                "source": source,
+                "time": timestamp,
+                "telegram_message_id": telegram_message_id
+                # Optional: Übernehmen von SL/TP-Updates, falls vorhanden,
+                # obwohl das "manipulation"-Feld in der Regel die Aktion beschreibt.
+            }
+
+            # Hinzufügen des Manipulationseintrags zur Batch (und zur DB, damit load_batch ihn wiederherstellt)
+            current_batch.upsert(new_manipulation_entry)
+            await add_entry(main_signalid, telegram_message_id, "manipulation", json.dumps(new_manipulation_entry))
+
+            # Die ursprüngliche Logik zur Aktualisierung der SL/TP-Werte in der Batch
+            # ist für die meisten Manipulationsarten NICHT gewünscht, da sie historische
+            # Daten überschreibt. Wir entfernen die Logik, die in-place die SL/TPs aller
+            # vorherigen Einträge ändert, um eine saubere Historie zu gewährleisten.
+
+            dedup_signals = current_batch
 
-        dedup_signals = current_batch
-
-    else:
-        # New Signal Case (No Manipulation)
-
-        # Deduplicate incoming signals before filling context fields
-        unique = {}
-        for signal in signals:
-            k = signal_key(signal)
-            unique[k] = signal
-
-        # Fill context fields
-        for k, sig in unique.items():  # Wir iterieren über k, sig um sicherzugehen
-            # 1. Standard-Kontext setzen
-            sig["signalid"] = main_signalid
-            if source: sig["source"] = source
-            if link: sig["link"] = make_telegram_link(link)
-            if timestamp: sig["time"] = timestamp
-            if telegram_message_id: sig["telegram_message_id"] = telegram_message_id
-
-            # 2. Kanal-spezifische Anpassungen (DIREKT im Objekt)
-            print(source)
-            if source in CHANNEL_CONFIG:
-                config = CHANNEL_CONFIG[source]
-
-                # A. Risk Overwrite
-                if "risk_overwrite" in config:
-                    sig["risk"] = config["risk_overwrite"]
-                    logger.info(f"SET RISK: {sig['risk']} for {source}")
-
-                # B. Entry Offset
-                offset_points = config.get("entry_offset", 0)
-                if offset_points != 0 and sig.get("entry") is not None:
-                    direction = sig.get("signal", "").upper()
-                    point_val = 0.01  # Standard für Gold
-
-                    try:
-                        old_entry = float(sig["entry"])
-                        # Wichtig: offset_points * point_val
-                        mod = offset_points * point_val
-
-                        if "BUY" in direction:
-                            sig["entry"] = round(old_entry + mod, 2)
-                        elif "SELL" in direction:
-                            sig["entry"] = round(old_entry - mod, 2)
-
-                        logger.info(f"OFFSET APPLIED: {old_entry} -> {sig['entry']} ({direction})")
-                    except Exception as e:
-                        logger.error(f"Offset error: {e}")
-
-            # 3. Erst JETZT in die Datenbank und den Batch-Speicher schreiben
-            if "manipulation" not in sig:
-                sig["manipulation"] = None
-
-            entry_type = "manipulation" if sig.get("manipulation") else "entry"
-
-            # WICHTIG: Hier muss das MODIFIZIERTE sig übergeben werden!
-            add_entry(main_signalid, telegram_message_id, entry_type, json.dumps(sig))
-
-            # 4. Update global in-memory batch mit den modifizierten Objekten
-        current_batch.extend(unique.values())
-
-        # Deduplicate the full batch based on the original signal_key logic
-        dedup_signals = list({signal_key(s): s for s in current_batch}.values())
-        signal_batches[main_signalid] = dedup_signals
-
-    # 3. Store full batch (new or updated state)
-
-    # NEUER SCHRITT: Chronologische Sortierung der Einträge
-    if dedup_signals:
-        try:
-            # Das 'time'-Feld ist ein ISO-8601-String. Lexikographische Sortierung ist chronologisch korrekt.
-            # Fallback auf einen sehr alten Timestamp, falls 'time' fehlt, um diesen Eintrag an den Anfang zu setzen.
-            dedup_signals.sort(key=lambda s: s.get("time", "1970-01-01T00:00:00Z"), reverse=False)
-            logger.info(f"Signal batch for {main_signalid} successfully sorted chronologically.")
-        except Exception as e:
-            logger.error(f"Failed to sort signals for {main_signalid}: {e}")
-            # Fährt fort mit dem Speichern, auch wenn die Sortierung fehlschlägt.
-
-    store_signal_batch(
-        dedup_signals,
-        main_signalid,
-        USE_LOCAL_STORAGE,
-        LOCAL_SIGNAL_FOLDER=storage_folder,
-    )
+        else:
+            # New Signal Case (No Manipulation)
+
+            # Deduplicate incoming signals before filling context fields
+            unique = {}
+            for signal in signals:
+                k = signal_key(signal)
+                unique[k] = signal
+
+            # Fill context fields
+            for k, sig in unique.items():  # Wir iterieren über k, sig um sicherzugehen
+                # 1. Standard-Kontext setzen
+                sig["signalid"] = main_signalid
+                if source: sig["source"] = source
+                if link: sig["link"] = make_telegram_link(link)
+                if timestamp: sig["time"] = timestamp
+                if telegram_message_id: sig["telegram_message_id"] = telegram_message_id
+
+                # 2. Kanal-spezifische Anpassungen (DIREKT im Objekt)
+                print(source)
+                if source in CHANNEL_CONFIG:
+                    config = CHANNEL_CONFIG[source]
+
+                    # A. Risk Overwrite
+                    if "risk_overwrite" in config:
+                        sig["risk"] = config["risk_overwrite"]
+                        logger.info(f"SET RISK: {sig['risk']} for {source}")
+
+                    # B. Entry Offset
+                    offset_points = config.get("entry_offset", 0)
+                    if offset_points != 0 and sig.get("entry") is not None:
+                        direction = sig.get("signal", "").upper()
+                        point_val = 0.01  # Standard für Gold
+
+                        try:
+                            old_entry = float(sig["entry"])
+                            # Wichtig: offset_points * point_val
+                            mod = offset_points * point_val
+
+                            if "BUY" in direction:
+                                sig["entry"] = round(old_entry + mod, 2)
+                            elif "SELL" in direction:
+                                sig["entry"] = round(old_entry - mod, 2)
+
+                            logger.info(f"OFFSET APPLIED: {old_entry} -> {sig['entry']} ({direction})")
+                        except Exception as e:
+                            logger.error(f"Offset error: {e}")
+
+                # 3. Erst JETZT in die Datenbank und den Batch-Speicher schreiben
+                if "manipulation" not in sig:
+                    sig["manipulation"] = None
+
+                entry_type = "manipulation" if sig.get("manipulation") else "entry"
+
+                # WICHTIG: Hier muss das MODIFIZIERTE sig übergeben werden!
+                await add_entry(main_signalid, telegram_message_id, entry_type, json.dumps(sig))
+
+                # 4. Update global in-memory batch mit den modifizierten Objekten.
+                # SignalBatch dedupliziert per signal_key und hält die Einträge chronologisch sortiert
+                # (ISO-8601 'time', fehlende Zeit zuerst) - kein Neuaufbau/Neusortieren der ganzen Batch.
+                current_batch.upsert(sig)
+
+            dedup_signals = current_batch
+
+        # 3. Store full batch (new or updated state)
+        # Upload/write off the event loop; the signal's lock keeps the batch unchanged meanwhile.
+        await asyncio.to_thread(
+            store_signal_batch,
+            dedup_signals,
+            main_signalid,
+            USE_LOCAL_STORAGE,
+            LOCAL_SIGNAL_FOLDER=storage_folder,
+        )
 
     # 4. FIX: Move logging before return statement
     logger.info(f"Signal batch for {main_signalid} written with {len(dedup_signals)} entries.")
     return main_signalid
 
 
-# Periodic cleanup thread to invalidate stale signals
-def cleanup_stale_signals(expiration_seconds=3600):
-    while True:
-        now = time.time()
+class SignalExpiryQueue:
+    """
+    Invalidates signals that are still pending expiration_seconds after they were sent.
+
+    Deadlines live in a min-heap (O(log n) per signal) and one asyncio task sleeps
+    until the earliest one, so nothing scans signal_states. A re-sent signal gets a new
+    heap item; the old one is recognised as stale by its sent_time and skipped.
+    schedule() may be called from any thread (e.g. Flask request threads).
+    """
+
+    def __init__(self, expiration_seconds: float):
+        self.expiration_seconds = expiration_seconds
+        self._heap: list[tuple[float, str, float]] = []  # (deadline, signalid, sent_time)
+        self._heap_lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+
+    def schedule(self, signalid: str, sent_time: float):
+        deadline = sent_time + self.expiration_seconds
+        with self._heap_lock:
+            heapq.heappush(self._heap, (deadline, signalid, sent_time))
+            is_earliest = self._heap[0][0] == deadline
+        # Lokale Kopien: run() kann parallel (anderer Thread) gerade erst starten
+        loop, wakeup = self._loop, self._wakeup
+        if is_earliest and loop is not None and wakeup is not None:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def _pop_due(self, now: float) -> list[tuple[float, str, float]]:
+        due = []
+        with self._heap_lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+        return due
+
+    def _next_deadline(self) -> float | None:
+        with self._heap_lock:
+            return self._heap[0][0] if self._heap else None
+
+    def _expire(self, signalid: str, sent_time: float, now: float):
         with lock:
-            stale_signals = [sid for sid, data in signal_states.items() if
-                             data["status"] == "pending" and (now - data["sent_time"]) > expiration_seconds]
-            for sid in stale_signals:
-                signal_states[sid]["status"] = "invalidated"
-                signal_states[sid]["history"].append(("invalidated", now))
-                logger.info(f"Signal {sid} marked as invalidated due to timeout.")
-        time.sleep(60)
-
-
-# You can run the cleanup thread alongside your app
-import threading
-
-cleanup_thread = threading.Thread(target=cleanup_stale_signals, daemon=True)
-cleanup_thread.start()
+            state = signal_states.get(signalid)
+            if not state or state["status"] != "pending" or state["sent_time"] != sent_time:
+                return
+            state["status"] = "invalidated"
+            state["history"].append(("invalidated", now))
+        logger.info(f"Signal {signalid} marked as invalidated due to timeout.")
+
+    async def run(self):
+        # Event vor dem Loop setzen: schedule() benutzt das Event, sobald _loop gesetzt ist
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        while True:
+            # Cleared before reading the heap: a schedule() after this point re-sets it.
+            self._wakeup.clear()
+            now = time.time()
+            for _, signalid, sent_time in self._pop_due(now):
+                self._expire(signalid, sent_time, now)
+            deadline = self._next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+signal_expiry = SignalExpiryQueue(SIGNAL_EXPIRATION_SECONDS)
+
+
+def start_signal_expiry() -> asyncio.Task:
+    """
+    Starts the expiry task on the running event loop (call once at startup).
+    """
+    return asyncio.create_task(signal_expiry.run(), name="signal-expiry")
 
 
 def run_flask():
@@ -0,0 +1,151 @@
+# signal_store.py
+"""
+Bounded in-memory maps for per-signal state (batches, counters, lifecycle states).
+
+A long-running worker sees an unbounded stream of signal IDs, so the plain dicts in
+signal_processor.py used to grow forever. BoundedSignalStore keeps the most recently
+used signals only: entries are evicted when the store exceeds max_entries (least
+recently used first) or when they were not touched for max_age seconds. Anything
+evicted can be rebuilt from signal_db (see get_or_load).
+"""
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+# Not walked: shared code/module objects (e.g. SignalBatch.key_fn) are not per-signal memory.
+_OPAQUE_TYPES = (str, bytes, int, float, bool, type(None), type, types.ModuleType, types.FunctionType,
+                 types.BuiltinFunctionType, types.MethodType)
+
+
+def _deep_sizeof(obj, seen=None) -> int:
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_sizeof(v, seen) for v in obj)
+    elif not isinstance(obj, _OPAQUE_TYPES):
+        # Objekte wie SignalBatch: Attribute aus __dict__ und __slots__ mitzählen
+        if hasattr(obj, "__dict__"):
+            size += _deep_sizeof(vars(obj), seen)
+        for cls in type(obj).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if hasattr(obj, name):
+                    size += _deep_sizeof(getattr(obj, name), seen)
+    return size
+
+
+class BoundedSignalStore(MutableMapping):
+    """
+    Dict-like LRU map with size and idle-age eviction.
+
+    Reads and writes count as use. Iteration and items() work on a snapshot and do
+    not refresh entries. Safe to share between threads.
+    """
+
+    def __init__(self, name: str, max_entries: int, max_age: float = 0):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._data: OrderedDict = OrderedDict()  # key -> (value, last_used)
+        self._lock = threading.RLock()
+        self.evicted_by_size = 0
+        self.evicted_by_age = 0
+        self.loads = 0
+        self.rehydrated = 0
+
+    def _evict(self, now: float):
+        if self.max_age:
+            while self._data:
+                key, (_, last_used) = next(iter(self._data.items()))
+                if now - last_used <= self.max_age:
+                    break
+                del self._data[key]
+                self.evicted_by_age += 1
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evicted_by_size += 1
+
+    def __getitem__(self, key):
+        with self._lock:
+            now = time.monotonic()
+            self._evict(now)
+            value, _ = self._data[key]
+            self._data[key] = (value, now)
+            self._data.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            now = time.monotonic()
+            self._data[key] = (value, now)
+            self._data.move_to_end(key)
+            self._evict(now)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            self._evict(time.monotonic())
+            return key in self._data
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._data))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def items(self):
+        with self._lock:
+            return [(key, value) for key, (value, _) in self._data.items()]
+
+    def values(self):
+        with self._lock:
+            return [value for value, _ in self._data.values()]
+
+    async def get_or_load(self, key, loader):
+        """
+        Returns the value for key; on a miss awaits loader(key), stores and returns it.
+        """
+        with self._lock:
+            if key in self:
+                return self[key]
+        value = await loader(key)
+        with self._lock:
+            self.loads += 1
+            if value:
+                self.rehydrated += 1
+            # Another task may have filled the key while the loader was running.
+            if key in self:
+                return self[key]
+            self[key] = value
+            return value
+
+    def stats(self) -> dict:
+        """
+        Entry count, eviction/rehydration counters and the approximate deep size in bytes
+        (walks every stored value, so call it for monitoring only).
+        """
+        with self._lock:
+            return {
+                "name": self.name,
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "max_age": self.max_age,
+                "evicted_by_size": self.evicted_by_size,
+                "evicted_by_age": self.evicted_by_age,
+                "loads": self.loads,
+                "rehydrated": self.rehydrated,
+                "approx_bytes": _deep_sizeof([value for value, _ in self._data.values()]),
+            }
@@ -0,0 +1,100 @@
+# stress_signal_processor.py
+"""
+Stress test for concurrent process_sanitized_signal calls.
+
+Creates N signals (4 entries each), then replays M replies per signal with the
+replies of all signals shuffled together and processed concurrently, so updates to
+the same signal interleave with updates to other signals. Afterwards every signal's
+in-memory batch, its rows in signal_db and the JSON file written for the EA must
+all contain exactly the original entries plus one entry per reply.
+
+Runs fully locally (USE_LOCAL_STORAGE, temporary SQLite DB).
+
+Usage: python stress_signal_processor.py [signals] [replies_per_signal]
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+_tmpdir = tempfile.mkdtemp(prefix="signal_stress_")
+os.environ["SIGNAL_DB_PATH"] = os.path.join(_tmpdir, "stress.db")
+os.environ["USE_LOCAL_STORAGE"] = "true"
+os.environ["LOCAL_SIGNAL_FOLDER"] = os.path.join(_tmpdir, "signals")
+
+import signal_db  # noqa: E402  (must see the environment above)
+import signal_processor  # noqa: E402
+from signal_db_async import get_or_create_signalid  # noqa: E402
+
+ENTRIES_PER_SIGNAL = 4
+
+
+def new_signal(msg_id):
+    return {"signals": [
+        {"instrument": "XAUUSD", "signal": "BUY LIMIT", "entry": 2400 - i, "sl": 2390, "tp": 2410 + i,
+         "manipulation": None}
+        for i in range(ENTRIES_PER_SIGNAL)
+    ]}
+
+
+def reply(manipulation):
+    return {"signals": [{"instrument": "XAUUSD", "manipulation": manipulation}]}
+
+
+async def process(sanitized, msg_id, reply_to, minute):
+    signalid = await get_or_create_signalid(reply_to or msg_id)
+    await asyncio.sleep(random.random() * 0.002)
+    return await signal_processor.process_sanitized_signal(
+        sanitized,
+        source="stress",
+        link=f"https://t.me/c/1001/{msg_id}",
+        timestamp=f"2025-01-01 {minute // 60 % 24:02d}:{minute % 60:02d}:00+00:00",
+        telegram_message_id=msg_id,
+        reply_to_msg_id=reply_to,
+        override_signalid=signalid,
+    )
+
+
+async def main(signals, replies):
+    signal_db.init_db()
+    parents = list(range(1, signals + 1))
+    signalids = await asyncio.gather(*(process(new_signal(m), m, None, 0) for m in parents))
+
+    jobs = []
+    next_id = 100_000
+    for parent in parents:
+        for r in range(replies):
+            jobs.append((reply(random.choice(["break_even", "close_all", "SL_CHANGE"])), next_id, parent, r + 1))
+            next_id += 1
+    random.shuffle(jobs)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(process(*job) for job in jobs))
+    elapsed = time.perf_counter() - start
+    await asyncio.to_thread(signal_db.flush)
+
+    expected = ENTRIES_PER_SIGNAL + replies
+    failures = 0
+    for signalid in signalids:
+        in_memory = len(signal_processor.signal_batches[signalid])
+        in_db = len(signal_db.get_entries(signalid))
+        with open(os.path.join(os.environ["LOCAL_SIGNAL_FOLDER"], f"signal_{signalid}.json"), encoding="utf-8") as f:
+            on_disk = len(json.load(f)["signals"])
+        if (in_memory, in_db, on_disk) != (expected, expected, expected):
+            failures += 1
+            print(f"MISMATCH {signalid}: memory={in_memory} db={in_db} file={on_disk} expected={expected}")
+
+    print(f"{len(jobs)} interleaved replies over {signals} signals in {elapsed:.2f} s "
+          f"({len(jobs) / elapsed:.0f} msgs/s), locks {signal_processor.signal_locks.stats()}")
+    print("OK" if not failures else f"FAILED: {failures} signals inconsistent")
+    return failures
+
+
+if __name__ == "__main__":
+    n_signals = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    n_replies = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    random.seed(1)
+    sys.exit(1 if asyncio.run(main(n_signals, n_replies)) else 0)
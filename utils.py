@@ -1,4 +1,8 @@
+import atexit
 import json
+import logging
+import logging.handlers
+import queue
 from datetime import datetime
 
 
@@ -10,16 +14,43 @@ def log_to_google_sheets(signal_text: str):
     print("📄 Logging to sheet:\n", signal_text)
 
 
-def log_skipped_signal(reason, signal, logfile="skipped_signals.log"):
+def skipped_signal_entry(reason, signal, **fields) -> str:
     entry = {
         "timestamp": datetime.utcnow().isoformat() + "Z",
         "level": "WARNING",
         "reason": reason,
-        "signal": signal
+        "signal": signal,
+        **fields
     }
+    return json.dumps(entry, ensure_ascii=False)
+
+
+def log_skipped_signal(reason, signal, logfile="skipped_signals.log", **fields):
     with open(logfile, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-import logging
+        f.write(skipped_signal_entry(reason, signal, **fields) + "\n")
+
+
+_queued_loggers: dict = {}
+
+
+def queued_file_logger(name: str, logfile: str) -> logging.Logger:
+    """
+    Logger whose records are appended to logfile (one message per line) by a QueueListener
+    thread, so logging from the event loop never waits for the disk. Flushed at exit.
+    """
+    if name not in _queued_loggers:
+        file_handler = logging.FileHandler(logfile, encoding="utf-8", delay=True)
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, file_handler)
+        listener.start()
+        atexit.register(listener.stop)
+        queued = logging.getLogger(name)
+        queued.setLevel(logging.INFO)
+        queued.propagate = False
+        queued.addHandler(logging.handlers.QueueHandler(log_queue))
+        _queued_loggers[name] = queued
+    return _queued_loggers[name]
 
 
 logger = logging.getLogger("signalworker.utils")